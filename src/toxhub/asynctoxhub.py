@@ -0,0 +1,437 @@
+import asyncio
+import urllib.parse
+from datetime import datetime, timedelta
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from . import decoder
+from .auth import Token
+from .chemistryservice import Compound, standardized
+from .datasource import DataSource
+from .query import Query, DataClass
+from .retry import RetryPolicy
+from .semanticservice import finding_codes, validated, vocabulary_param_string
+from .similarityservice import SimilarStructure, similar_structures
+
+
+class AsyncAuth:
+    """Manages authentication with the ToxHub for the asynchronous client"""
+
+    def __init__(self, username: str, password: str, env: str, client_secret: str, client):
+        self.url = f'https://login.{env}.toxhub.etransafe.eu/auth/realms/KH/protocol/openid-connect'
+        self.__client = client
+        self.__clientSecret = client_secret
+        self.__username = username
+        self.__password = password
+        self.__token = None
+        self.__lock = None
+
+    async def header(self):
+        """
+        Get a valid authorization header required for ToxHub services
+        :return: Valid authorization header
+        """
+        return {"Authorization": f"Bearer {await self.token()}"}
+
+    async def token(self) -> str:
+        """
+        Get a valid token from ToxHub, only obtains a new token when current token has expired.
+        Concurrent callers share a single token request.
+        :return: a token
+        """
+        if self.__lock is None:
+            # created lazily so it belongs to the event loop that is running the calls
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            if self.__token is None or not self.__token.is_valid():
+                await self.__refresh_token()
+            return self.__token.value if self.__token else None
+
+    async def __refresh_token(self):
+        data = {'grant_type': 'password', 'username': self.__username, 'password': self.__password,
+                'client_id': 'knowledge-hub', 'client_secret': self.__clientSecret}
+        r = await self.__client.post(f'{self.url}/token', data=data)
+        if r.status_code == 200:
+            token_value = decoder.loads(r.content)['access_token']
+            token_exp = datetime.now() + timedelta(seconds=int(decoder.loads(r.content)['expires_in']) - 60)
+            self.__token = Token(token_value, token_exp)
+            print('Successfully authenticated with ToxHub')
+        else:
+            print(f'Failed to obtain token, received status code:{r.status_code}')
+
+
+class AsyncPrimitiveAdaptor:
+
+    def __init__(self, url: str, auth: AsyncAuth, client, retry: RetryPolicy = None):
+        self.url = url
+        self.retry = retry if retry else RetryPolicy()
+        self.__auth = auth
+        self.__client = client
+
+    async def execute(self, query: Query, datasource: DataSource, converter=lambda x: x) -> []:
+        """
+        Execute a query on ToxHub, once the total is known all remaining pages are requested concurrently.
+        Requests answered with 429 or a 5xx status are retried according to the retry policy,
+        when a page still fails a RuntimeError is raised.
+
+        :param query: Query to be executed, can easily be constructed with the QueryBuilder
+        :param datasource: Data source at which the query is targeted
+        :param converter: optional conversion of returned items, for example 'lambda x: Compound(x)'
+        :return: list of items
+        """
+        url = f'{self.url}{datasource.path}/query'
+        default_batch_size = 5000
+        fetch_all = query.limit == 0 or query.limit > default_batch_size
+        body = query.to_dict()
+        body['limit'] = default_batch_size if fetch_all else query.limit
+        query_results, total = await self.__page(url, body)
+        if fetch_all:
+            offsets = range(query.offset + default_batch_size, total, default_batch_size)
+            pages = await asyncio.gather(*[self.__page(url, {**body, 'offset': offset}) for offset in offsets])
+            for page in pages:
+                query_results.extend(page[0])
+        return list(map(converter, query_results))
+
+    async def compound(self, idx: int, data_source: DataSource):
+        return await self.__item(idx, data_source, DataClass.COMPOUND)
+
+    async def study(self, idx: int, data_source: DataSource):
+        return await self.__item(idx, data_source, DataClass.STUDY)
+
+    async def finding(self, idx: int, data_source: DataSource):
+        return await self.__item(idx, data_source, DataClass.FINDING)
+
+    async def findings(self, ids: [int], data_source: DataSource) -> []:
+        url = f'{self.url}{data_source.path}/data/FINDING/batch'
+        r = await self.__request(url, {'ids': ids})
+        if r.status_code == 200:
+            return decoder.loads(r.content)
+        else:
+            print(f'Failed to load findings from {data_source}')
+
+    async def external_additional_property(self, idx: int, property_name: str, data_class: DataClass,
+                                           data_source: DataSource):
+        url = f'{self.url}{data_source.path}/data/{data_class.key()}/{idx}/additionalproperties'
+        batch_size = 1000
+        query = {
+            "propertyName": property_name,
+            "resultType": "TREE",
+            "offset": 0,
+            "limit": batch_size
+        }
+        total = 1
+        result = []
+        while total > query['offset']:
+            r = await self.__request(url, query)
+            if r.status_code != 200:
+                raise RuntimeError(f'Cannot retrieve {property_name} from {url}: {r.status_code} {r.text}')
+            response = decoder.loads(r.content)
+            result.extend(response['data'])
+            total = response['total']
+            query['offset'] += batch_size
+        return result
+
+    async def __item(self, idx: int, data_source: DataSource, data_class: DataClass):
+        url = f'{self.url}{data_source.path}/data/{data_class.key()}/{idx}'
+        r = await self.__request(url)
+        if r.status_code == 200:
+            return decoder.loads(r.content)
+        else:
+            print(f'Failed to get {data_class.key().lower()} {idx} from {data_source}')
+
+    async def __page(self, url: str, body: dict):
+        resp = await self.__request(url, body)
+        if resp.status_code != 200:
+            raise RuntimeError(f'Request to {url} failed {resp.status_code} {resp.text}')
+        result_data = decoder.loads(resp.content)['resultData']
+        return result_data['data'], result_data['total']
+
+    async def __request(self, url: str, body: dict = None):
+        """
+        Send a GET, or a POST when there is a body, retried according to the retry policy
+        without blocking the event loop while waiting
+
+        :return: the first response that should not be retried, or the last response when retries run out
+        """
+        for attempt in range(self.retry.retries + 1):
+            try:
+                if body is None:
+                    response = await self.__client.get(url, headers=await self.__auth.header())
+                else:
+                    response = await self.__client.post(url, headers=await self.__auth.header(), json=body)
+            except httpx.TransportError as e:
+                if attempt == self.retry.retries:
+                    raise
+                print(f'Request failed: {e}, retrying')
+                await asyncio.sleep(self.retry.delay(attempt))
+                continue
+            if response.status_code not in self.retry.statuses or attempt == self.retry.retries:
+                return response
+            print(f'Request to {url} returned {response.status_code}, retrying')
+            await asyncio.sleep(self.retry.delay(attempt, response))
+
+
+class AsyncSemanticService:
+
+    def __init__(self, url, auth: AsyncAuth, client):
+        self.url = url + "/api/semanticservice/v1"
+        self.__auth = auth
+        self.__client = client
+
+    async def lookup(self, term: str, vocabularies: [str], n_results: int = 20) -> [str]:
+        v = vocabulary_param_string(vocabularies)
+        params = {'query': term, 'count': n_results}
+        path = "/concept/lookup?" + urllib.parse.urlencode(params) + v
+        resp = await self.__get(path)
+        return resp['terms']
+
+    async def normalize(self, term: str, vocabularies: [str] = None, nonpreferred: bool = False) -> []:
+        if vocabularies and nonpreferred:
+            print("You can't specify a vocabulary and query non-preferred terms, just won't work")
+            return []
+        if vocabularies is None:
+            vocabularies = []
+        v = vocabulary_param_string(vocabularies)
+        params = {'term': term, 'nonpreferred': nonpreferred}
+        path = '/concept/normalize?' + urllib.parse.urlencode(params) + v
+        resp = await self.__get(path)
+        return resp.get('concepts')
+
+    async def concept_by_id(self, concept_id: int):
+        resp = await self.__get(f'/concept/{concept_id}')
+        if resp:
+            return resp.get('concept')
+
+    async def smqs(self) -> []:
+        """
+        Retrieve a list of all Structured MedDRA Queries
+
+        :return: list of SMQs
+        """
+        resp = await self.__get('/concept', params={"conceptClassId": "SMQ"})
+        if resp:
+            return resp
+
+    async def concepts_by_smq(self, concept_id: int) -> []:
+        """
+        Retrieve all the preferred terms for an SMQ
+
+        :param concept_id: concept_id of SMQ for which you which to recieve concepts
+        :return: List of preferred terms contained in SMQ
+        """
+        resp = await self.expand(concept_id)
+        return resp[0]['children']
+
+    async def map_to_clinical(self, adverse_event_code: str, organ_code: str) -> []:
+        """
+        Map a preclinical adverse event with organ code to a list of clinical equivalents
+
+        :param adverse_event_code:
+        :param organ_code:
+        :return: list of mappings
+        """
+        params = {"adverseEventCode": adverse_event_code, "organCode": organ_code}
+        result = await self.__get('/concept/map/clinical', params=params)
+        if result:
+            return result['mappings']
+
+    async def map_to_preclinical(self, adverse_event_code: str) -> []:
+        """
+        map a MedDRA Preferred Term to a list of preclinical organ - finding combinations
+
+        :param adverse_event_code:
+        :return: list of mappings
+        """
+        result = await self.__get('/concept/map/preclinical', params={"adverseEventCode": adverse_event_code})
+        if result:
+            return result['mappings']
+
+    async def socs_for_findings(self, findings: [dict]):
+        """
+        Retrieve the system organ class for a concept code or a MA or PT concept name,
+        the unique codes of all findings are requested in chunks that are sent concurrently
+
+        :param findings:
+        :return: list of mappings
+        """
+        if not isinstance(findings, list):
+            findings = [findings]
+
+        codes = finding_codes(findings)
+        chunks = [codes[i:i + 100] for i in range(0, len(codes), 100)]
+        socs = await asyncio.gather(*[self.socs_by_concept_codes(chunk) for chunk in chunks])
+        return [soc for s in socs if s for soc in s]
+
+    async def socs_by_concept_codes(self, codes: []):
+        url = f'{self.url}/concept/map/soc'
+        r = await self.__client.post(url, headers=await self.__auth.header(), json={'conceptCodes': codes})
+        return validated(r, url)
+
+    async def concept_by_name(self, concept_name: str, vocabularies: [str] = None) -> []:
+        if vocabularies is None:
+            vocabularies = []
+        concepts = await self.normalize(concept_name, vocabularies)
+        if len(concepts) > 0:
+            return concepts
+        else:
+            return None
+
+    async def expand(self, concept_id: int, parent_levels=None, child_levels=None):
+        params = {
+            'parentlevels': parent_levels if parent_levels else '',
+            'childlevels': child_levels if child_levels else ''
+        }
+        path = f'/concept/{concept_id}/expand?' + urllib.parse.urlencode(params)
+        resp = await self.__get(path)
+        if resp:
+            return resp['concepts']
+
+    async def __get(self, path: str, params: dict = None):
+        url = self.url + path
+        resp = await self.__client.get(url, headers=await self.__auth.header(), params=params)
+        return validated(resp, url)
+
+
+class AsyncChemistryService:
+    """Provides asynchronous access to the ToxHub Chemistry Service"""
+
+    def __init__(self, base: str, auth: AsyncAuth, client):
+        self.__auth = auth
+        self.url = base + "/chemistryservice.kh.svc/v1"
+        self.__client = client
+
+    async def compound_by_name(self, name):
+        """Returns a standardized compound object from the chemistry service based on the provided name.
+        If name could not be standardized by the chemistry service None is returned"""
+        return await self.__standardize(name, 'clinical')
+
+    async def compound_by_smiles(self, smiles):
+        """Returns a standardized compound object from the chemistry service based on the provided smiles.
+        If smiles could not be standardized by the chemistry service None is returned"""
+        return await self.__standardize(smiles, 'preclinical')
+
+    async def standardize_smiles(self, smiles):
+        """Returns a standardized smiles from the chemistry service based on the provided smiles.
+        If smiles could not be standardized by the chemistry service None is returned"""
+        compound = await self.compound_by_smiles(smiles)
+        if compound:
+            return compound.smiles
+        return None
+
+    async def __standardize(self, compound, pa_type):
+        url = f'{self.url}/pa_standardize'
+        r = await self.__client.post(url, data={'compound': compound, 'pa_type': pa_type},
+                                     headers=await self.__auth.header())
+        c = standardized(r, url)[1]
+        return Compound(c) if c else None
+
+
+class AsyncSimilarityService:
+
+    def __init__(self, toxhub_url, auth: AsyncAuth, client):
+        self.__auth = auth
+        self.url = toxhub_url + '/flame.kh.svc/api/v1'
+        self.__client = client
+
+    async def ready(self) -> bool:
+        """
+        Check readiness of similarity service
+
+        :return: Boolean indiciating whether similarity service is ready or not
+        """
+        r = await self.__client.get(self.url + '/ready', headers=await self.__auth.header())
+        return r.status_code == 200
+
+    async def get(self, smiles: str, datasource: DataSource, algo: str = 'morganFP', n_res: int = 10, cutoff=0.5,
+                  poll_interval: float = 1) -> [SimilarStructure]:
+        """
+        Get similar compounds based on smiles available for the provided data source,
+        the event loop is free for other calls while the search is running
+
+        :param smiles: smiles to find similiar structures for
+        :param datasource: datasource in which to search
+        :param algo: e.g. substructureFP, rdkFP, RDKit_md, morganFP
+        :param n_res: number of results
+        :param cutoff: threshold ranging from 0 - 1
+        :param poll_interval: seconds to wait before each poll of the search results
+        :return: a list of similar structures
+        """
+        space = f'{datasource.chemicalSpace}_{algo}'
+        url = f'{self.url}/search/space/{space}/version/0/smiles?numsel={n_res}&cutoff={cutoff}'
+        r = await self.__client.put(url, headers=await self.__auth.header(), data={'SMILES': smiles})
+
+        result = []
+        if r.status_code != 200:
+            print('request failed:' + str(r.status_code) + ', msg:' + r.text)
+            return result
+
+        search_id = r.text.replace('"', '')
+        while True:
+            await asyncio.sleep(poll_interval)
+            r2 = await self.__client.get(self.url + '/smanage/search/' + search_id, headers=await self.__auth.header())
+            if r2.status_code != 200:
+                print('Collecting results failed:' + str(r2.status_code) + ', msg:' + r2.text)
+                return result
+            if 'waiting' not in r2.text:
+                break
+        return similar_structures(decoder.loads(r2.content))
+
+    async def spaces(self):
+        r = await self.__client.get(self.url + '/smanage/spaces', headers=await self.__auth.header())
+        if r.status_code == 200:
+            obj = decoder.loads(r.content)
+            return obj[1]
+
+    async def space_names(self):
+        sps = await self.spaces()
+        if sps:
+            return list(map(lambda s: s['spacename'], sps))
+
+
+class AsyncToxHub:
+
+    def __init__(self, username: str, password: str, env: str, client_secret: str, session_verify=True,
+                 max_connections: int = 100, retry: RetryPolicy = None):
+        """
+        Asynchronous counterpart of ToxHub, every service method is a coroutine and all services share
+        one pooled HTTP client. Requires the optional httpx dependency (pip install toxhub[async]).
+
+        Use it as an async context manager, or call close() when done:
+
+            async with AsyncToxHub(username, password, env, client_secret) as toxhub:
+                findings = await asyncio.gather(*[toxhub.primitiveAdaptor.execute(q, s) for s in sources])
+
+        :param username: Your ToxHub username
+        :param password: Your ToxHub password
+        :param env: Environment e.g. 'dev', 'test', 'bayer', 'novartis' etc.
+        :param client_secret: Each env has its own client secret, contact GMV to find out what it is.
+        :param session_verify: Override when using self-signed certificates.
+        Set to false if you want to ignore certificate checks,
+        alternatively pass path to .pem file to allow self-signed certificate.
+        :param max_connections: Maximum number of connections kept open by the shared client
+        :param retry: Optional policy for retrying failed requests of the primitive adaptors,
+        by default failed requests are retried 5 times
+        """
+        if httpx is None:
+            raise ImportError('AsyncToxHub requires httpx, install it with: pip install toxhub[async]')
+        url = f'https://{env}.toxhub.etransafe.eu'
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = httpx.AsyncClient(verify=session_verify, limits=limits, timeout=None)
+        auth = AsyncAuth(username, password, env, client_secret, self.client)
+        self.auth = auth
+        self.semanticService = AsyncSemanticService(url, auth, self.client)
+        self.chemistryService = AsyncChemistryService(url, auth, self.client)
+        self.similarityService = AsyncSimilarityService(url, auth, self.client)
+        self.primitiveAdaptor = AsyncPrimitiveAdaptor(url, auth, self.client, retry)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
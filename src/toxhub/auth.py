@@ -1,4 +1,5 @@
 import json
+import threading
 from datetime import datetime, timedelta
 
 from requests import Session
@@ -27,6 +28,7 @@ class Auth:
         self.__clientSecret = client_secret
         self.__username = username
         self.__password = password
+        self.__lock = threading.Lock()
         self.__refresh_token()
 
     def header(self):
@@ -41,9 +43,10 @@ class Auth:
         Get a valid token from ToxHub, only obtains a new token when current token has expired.
         :return: a token
         """
-        if not self.__token.is_valid():
-            self.__refresh_token()
-        return self.__token.value
+        with self.__lock:
+            if not self.__token.is_valid():
+                self.__refresh_token()
+            return self.__token.value
 
     def __refresh_token(self):
         data = {'grant_type': 'password', 'username': self.__username, 'password': self.__password,
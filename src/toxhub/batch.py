@@ -0,0 +1,183 @@
+import copy
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .datasource import DataSource
+from .primitiveadaptor import PrimitiveAdaptor
+from .query import Query, DataClass, SelectedField, ComparisonOperator
+
+
+class Batch:
+    """Queries that only differ in the value of one EQUALS criterion, executed as chunked IN queries"""
+
+    def __init__(self, queries: [(int, Query)], group: int, position: int):
+        self.queries = queries
+        self.group = group
+        self.position = position
+
+    def criterion(self, query: Query):
+        return query.filter.criteria[self.group][self.position]
+
+    def field(self):
+        return self.criterion(self.queries[0][1]).field
+
+    def value(self, query: Query):
+        return self.criterion(query).values[0].value
+
+    def merged(self, values: []) -> Query:
+        """
+        :return: copy of the first query with the EQUALS criterion replaced by an IN criterion on values
+        """
+        query = copy.deepcopy(self.queries[0][1])
+        field = self.field()
+        query.filter.criteria[self.group][self.position] = field.in_(values)
+        # the rows need the value of the criterion to split them per query again
+        selected = [s for s in query.selectedFields if s.dataClassKey == field.dataClassKey]
+        if len(selected) == 0:
+            query.selectedFields.append(SelectedField(DataClass[field.dataClassKey], [field.name]))
+        elif self.extends_projection():
+            selected[0].names.append(field.name)
+        return query
+
+    def extends_projection(self) -> bool:
+        """
+        :return: whether the data class of the criterion is selected with a projection without the field of the
+        criterion, merged() then adds the field to the projection
+        """
+        field = self.field()
+        selected = [s for s in self.queries[0][1].selectedFields if s.dataClassKey == field.dataClassKey]
+        return len(selected) > 0 and all(field.name not in s.names for s in selected)
+
+
+class BatchPlanner:
+    """
+    Runs many queries that only differ in the value of one EQUALS criterion, for example one
+    QueryBuilder().where(Fields.COMPOUND_INCHIKEY.eq_(key)) query per compound, as chunked IN queries.
+    The returned rows are split per original query again on the value of that criterion.
+    """
+
+    def __init__(self, primitive_adaptor: PrimitiveAdaptor, chunk_size: int = 100):
+        self.__pa = primitive_adaptor
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def plan(queries: [Query]) -> ([Batch], [int]):
+        """
+        Group the queries that can be merged
+
+        :param queries: queries to group
+        :return: the batches and the indexes of the queries that could not be merged with any other query
+        """
+        candidates = [BatchPlanner.__candidates(q) for q in queries]
+        counts = Counter(signature for c in candidates for signature in c)
+        groups = {}
+        for i, c in enumerate(candidates):
+            if len(c) > 0:
+                signature = max(c, key=lambda s: counts[s])
+                groups.setdefault(signature, []).append(i)
+        batches = []
+        single = [i for i, c in enumerate(candidates) if len(c) == 0]
+        for signature, indexes in groups.items():
+            if len(indexes) == 1:
+                single.extend(indexes)
+            else:
+                group, position = candidates[indexes[0]][signature]
+                batches.append(Batch([(i, queries[i]) for i in indexes], group, position))
+        return batches, sorted(single)
+
+    def execute(self, queries: [Query], datasource: DataSource, converter=lambda x: x, key=None,
+                workers: int = 1) -> [[]]:
+        """
+        Execute the queries on a data source with as few requests as possible
+
+        :param queries: queries to execute
+        :param datasource: Data source at which the queries are targeted
+        :param converter: optional conversion of returned items, for example 'lambda x: Compound(x)'
+        :param key: optional function taking a row and the merged field, returning the value of the field in the row.
+        By default the value is looked up in the row itself and in a nested dict of the data class of the field.
+        When the value of a row can not be read the queries of its merged query are run one by one.
+        :param workers: number of merged queries executed in parallel
+        :return: list with the items of each query, in the same order as queries
+        """
+        key = key if key else BatchPlanner.__key
+        batches, single = self.plan(queries)
+        results = [[] for _ in queries]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            jobs = []
+            for batch in batches:
+                values = {}
+                for _, q in batch.queries:
+                    values.setdefault(self.__normalized(batch, batch.value(q)), batch.value(q))
+                values = list(values.values())
+                for i in range(0, len(values), self.chunk_size):
+                    chunk = values[i:i + self.chunk_size]
+                    jobs.append((batch, chunk, executor.submit(self.__pa.execute, batch.merged(chunk), datasource)))
+            singles = [(i, executor.submit(self.__pa.execute, queries[i], datasource, converter)) for i in single]
+
+            for batch, chunk, job in jobs:
+                indexes = {}
+                for i, q in batch.queries:
+                    indexes.setdefault(self.__normalized(batch, batch.value(q)), []).append(i)
+                field = batch.field()
+                added = batch.extends_projection()
+                rows = job.result()
+                values = [key(row, field) for row in rows]
+                if any(v is None for v in values):
+                    # rows that can not be split per query are not dropped, the original queries are run instead
+                    print(f'Cannot read {field.dataClassKey} {field.name} from the rows of a merged query, '
+                          f'running its {len(chunk)} queries one by one')
+                    for value in chunk:
+                        for i in indexes[self.__normalized(batch, value)]:
+                            singles.append((i, executor.submit(self.__pa.execute, queries[i], datasource, converter)))
+                    continue
+                for row, value in zip(rows, values):
+                    matching = indexes.get(self.__normalized(batch, value), [])
+                    if added:
+                        # rows are returned as the original queries would return them
+                        row.pop(field.name, None)
+                    if len(matching) > 0:
+                        item = converter(row)
+                        for i in matching:
+                            results[i].append(item)
+            for i, job in singles:
+                results[i] = job.result()
+        return results
+
+    @staticmethod
+    def __candidates(query: Query) -> dict:
+        """
+        :return: dict of signature to (group, position) of every EQUALS criterion on a returned field
+        the query could be merged on
+        """
+        if query.offset != 0 or query.limit != 0:
+            return {}
+        body = query.to_dict()
+        result = {}
+        for g, criteria in enumerate(body['filter']['criteria']):
+            for p, criterion in enumerate(criteria):
+                field = criterion['field']
+                if field['name'] not in DataClass[field['dataClassKey']].fields():
+                    # only fields that are returned can be used to split the rows per query again
+                    continue
+                if criterion['comparisonOperator'] == ComparisonOperator.EQUALS.value and len(criterion['values']) == 1:
+                    value = criterion['values']
+                    criterion['values'] = None
+                    result[(g, p, json.dumps(body, sort_keys=True))] = (g, p)
+                    criterion['values'] = value
+        return result
+
+    @staticmethod
+    def __normalized(batch: Batch, value):
+        criterion = batch.criterion(batch.queries[0][1])
+        if isinstance(value, str) and not getattr(criterion, 'caseSensitive', True):
+            return value.lower()
+        return value
+
+    @staticmethod
+    def __key(row: dict, field):
+        if field.name in row:
+            return row[field.name]
+        nested = row.get(field.dataClassKey.lower())
+        if isinstance(nested, dict):
+            return nested.get(field.name)
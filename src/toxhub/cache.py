@@ -0,0 +1,330 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from . import decoder
+
+
+class CachedResponse:
+    """Successful response served from the cache, exposes the same attributes as a requests Response"""
+
+    status_code = 200
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache:
+    """
+    Persistent cache of ToxHub responses in a SQLite database.
+
+    Entries are stored compressed and expire after ttl seconds. When the total size of the stored entries exceeds
+    max_size bytes the least recently used entries are evicted. Concurrent requests for the same key share a single
+    call to the loader.
+    """
+
+    # number of puts after which the size is recounted from the database
+    RECOUNT_INTERVAL = 1000
+
+    def __init__(self, path: str = 'toxhub_cache.sqlite', ttl: float = 24 * 60 * 60,
+                 max_size: int = 1024 * 1024 * 1024):
+        """
+        :param path: Location of the SQLite database, created when it does not exist
+        :param ttl: Seconds after which an entry expires, None keeps entries until they are evicted
+        :param max_size: Maximum number of bytes of compressed entries kept in the cache
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.__lock = threading.Lock()
+        self.__in_flight = {}
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__db:
+            self.__db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, '
+                              'size INTEGER, created REAL, accessed REAL)')
+            self.__db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            self.__size = self.__db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        self.__puts = 0
+
+    @staticmethod
+    def key(url: str, body: dict = None) -> str:
+        """
+        Cache key of a request, the url combined with a hash of the canonical json of the request body
+
+        :param url: url of the request, including the data source path
+        :param body: optional json body of the request, for example Query.to_dict()
+        :return: cache key
+        """
+        canonical = json.dumps(body, sort_keys=True, separators=(',', ':'))
+        return f'{url}#{hashlib.sha256(canonical.encode("utf-8")).hexdigest()}'
+
+    def get(self, key: str):
+        """
+        :return: the cached bytes for key, None when the key is not cached or has expired
+        """
+        now = time.time()
+        with self.__lock, self.__db:
+            row = self.__db.execute('SELECT value, created FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                self.__delete(key)
+                return None
+            self.__db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return zlib.decompress(row[0])
+
+    def put(self, key: str, value: bytes):
+        """
+        Store value under key. When the cache grows beyond max_size the least recently used entries are evicted,
+        down to 90% of max_size so that evictions do not happen on every put of a full cache.
+        The entry that is stored is never evicted by its own put.
+        """
+        compressed = zlib.compress(value)
+        now = time.time()
+        with self.__lock, self.__db:
+            self.__delete(key)
+            self.__db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                              (key, compressed, len(compressed), now, now))
+            self.__size += len(compressed)
+            self.__puts += 1
+            if self.__puts % ResponseCache.RECOUNT_INTERVAL == 0:
+                # the running size only counts the puts of this process, other processes sharing the database
+                # are accounted for by recounting regularly
+                self.__size = self.__db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if self.__size <= self.max_size:
+                return
+            self.__size = self.__db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            target = self.max_size * 0.9
+            evicted = []
+            for evict_key, evict_size in self.__db.execute('SELECT key, size FROM entries WHERE key != ? '
+                                                           'ORDER BY accessed', (key,)):
+                if self.__size <= target:
+                    break
+                evicted.append((evict_key,))
+                self.__size -= evict_size
+            self.__db.executemany('DELETE FROM entries WHERE key = ?', evicted)
+
+    def fetch(self, key: str, loader):
+        """
+        Get the response for key from the cache, or load it when it is not cached.
+        Only one loader runs at a time for the same key, other threads wait for its result.
+
+        :param key: cache key, see key()
+        :param loader: function returning a tuple of the response and the bytes to cache, None to skip caching
+        :return: a CachedResponse or the response returned by the loader
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return CachedResponse(value)
+            with self.__lock:
+                event = self.__in_flight.get(key)
+                leader = event is None
+                if leader:
+                    event = self.__in_flight[key] = threading.Event()
+            if leader:
+                break
+            event.wait()
+            value = self.get(key)
+            if value is not None:
+                return CachedResponse(value)
+        try:
+            response, value = loader()
+            if value is not None:
+                self.put(key, value)
+            return response
+        finally:
+            with self.__lock:
+                del self.__in_flight[key]
+            event.set()
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.__lock, self.__db:
+            self.__db.execute('DELETE FROM entries')
+            self.__size = 0
+
+    def __delete(self, key: str):
+        row = self.__db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            self.__db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.__size -= row[0]
+
+
+class ConceptCache:
+    """
+    Memoizes semantic service lookups in a size-bounded in-memory LRU, optionally backed by a ResponseCache on disk.
+    Entries expire after ttl seconds. Cached values are shared between callers, so they should not be modified.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 24 * 60 * 60, disk: ResponseCache = None):
+        """
+        :param max_entries: Maximum number of responses kept in memory, the least recently used are evicted first
+        :param ttl: Seconds after which an in-memory entry expires, None keeps entries until they are evicted.
+        Entries on disk expire according to the ttl of the disk cache.
+        :param disk: Optional persistent cache consulted when a response is not in memory
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+
+    def fetch(self, key: str, loader):
+        """
+        Get the value for key, or load it when it is not cached
+
+        :param key: cache key, see ResponseCache.key()
+        :param loader: function returning a tuple of the decoded value and the bytes it was decoded from,
+        the value is not cached when the bytes are None
+        :return: the value
+        """
+        now = time.time()
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and (self.ttl is None or now - entry[1] <= self.ttl):
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        if self.disk is not None:
+            content = self.disk.get(key)
+            if content is not None:
+                value = decoder.loads(content)
+                self.__put(key, value, now)
+                with self.__lock:
+                    self.disk_hits += 1
+                return value
+        with self.__lock:
+            self.misses += 1
+        value, content = loader()
+        if content is not None:
+            self.__put(key, value, now)
+            if self.disk is not None:
+                self.disk.put(key, content)
+        return value
+
+    def stats(self) -> dict:
+        """
+        :return: number of memory hits, disk hits, misses and entries in memory
+        """
+        with self.__lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'entries': len(self.__entries)}
+
+    def clear(self):
+        """Remove all entries from memory and reset the counters, the disk cache is left as is"""
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+    def __put(self, key: str, value, now: float):
+        with self.__lock:
+            self.__entries[key] = (value, now)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+
+class StandardizationCache:
+    """
+    Persistent cache of chemistry service standardizations in a SQLite database, keyed on the input and pa_type.
+    Inputs that could not be standardized are cached as well, with their own, usually shorter, ttl.
+
+    The standardized compounds are also indexed by InChIKey, and their name, smiles and InChIKey are registered as
+    inputs, so standardizing the same structure under another input does not need a request.
+    """
+
+    def __init__(self, path: str = 'toxhub_standardization.sqlite', ttl: float = 30 * 24 * 60 * 60,
+                 negative_ttl: float = 24 * 60 * 60):
+        """
+        :param path: Location of the SQLite database, created when it does not exist
+        :param ttl: Seconds after which a standardized compound expires, None keeps compounds forever
+        :param negative_ttl: Seconds after which an input that could not be standardized expires,
+        None keeps them forever
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__db:
+            self.__db.execute('CREATE TABLE IF NOT EXISTS inputs (input TEXT, pa_type TEXT, inchikey TEXT, '
+                              'created REAL, PRIMARY KEY (input, pa_type))')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS compounds (inchikey TEXT PRIMARY KEY, value TEXT, '
+                              'created REAL)')
+
+    def get(self, compound: str, pa_type: str) -> (bool, dict):
+        """
+        :param compound: name or smiles that was standardized
+        :param pa_type: 'clinical' or 'preclinical'
+        :return: tuple of whether the input is cached and the standardized compound, which is None when the input
+        could not be standardized
+        """
+        now = time.time()
+        with self.__lock:
+            row = self.__db.execute('SELECT i.inchikey, i.created, c.value, c.created FROM inputs i '
+                                    'LEFT JOIN compounds c ON c.inchikey = i.inchikey '
+                                    'WHERE i.input = ? AND i.pa_type = ?', (compound, pa_type)).fetchone()
+        if row is None:
+            return False, None
+        inchikey, created, value, compound_created = row
+        if inchikey is None:
+            return self.negative_ttl is None or now - created <= self.negative_ttl, None
+        if value is None or (self.ttl is not None and now - min(created, compound_created) > self.ttl):
+            return False, None
+        return True, json.loads(value)
+
+    def put(self, compound: str, pa_type: str, result: dict = None):
+        """
+        Store the standardization of an input, register the name, smiles and InChIKey of the result as inputs
+
+        :param compound: name or smiles that was standardized
+        :param pa_type: 'clinical' or 'preclinical'
+        :param result: the standardized compound as returned by the chemistry service, None when the input could not
+        be standardized
+        """
+        now = time.time()
+        inchikey = result.get('inchikey') if result else None
+        with self.__lock, self.__db:
+            if inchikey is None:
+                self.__db.execute('INSERT OR REPLACE INTO inputs VALUES (?, ?, NULL, ?)', (compound, pa_type, now))
+                return
+            self.__db.execute('INSERT OR REPLACE INTO compounds VALUES (?, ?, ?)',
+                              (inchikey, json.dumps(result), now))
+            self.__db.execute('INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?)', (compound, pa_type, inchikey, now))
+            aliases = [(result.get('name'), 'clinical'), (inchikey, 'clinical'), (result.get('smiles'), 'preclinical')]
+            # aliases replace negative entries, not the standardization of another structure
+            self.__db.executemany('INSERT OR REPLACE INTO inputs SELECT ?, ?, ?, ? WHERE NOT EXISTS '
+                                  '(SELECT 1 FROM inputs WHERE input = ? AND pa_type = ? AND inchikey IS NOT NULL '
+                                  'AND inchikey != ?)',
+                                  [(a, t, inchikey, now, a, t, inchikey) for a, t in aliases if a])
+
+    def by_inchikey(self, inchikey: str) -> dict:
+        """
+        :return: the standardized compound with inchikey, None when it is not cached or has expired
+        """
+        with self.__lock:
+            row = self.__db.execute('SELECT value, created FROM compounds WHERE inchikey = ?', (inchikey,)).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+            return None
+        return json.loads(row[0])
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.__lock, self.__db:
+            self.__db.execute('DELETE FROM inputs')
+            self.__db.execute('DELETE FROM compounds')
@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+
+from . import decoder
+
+
+class Checkpoint:
+    """
+    Records the completed pages of a query in a file, one json line per page,
+    so an interrupted pull continues where it stopped instead of starting over.
+    The file belongs to a single query, a file written for another query is started over.
+    """
+
+    def __init__(self, path: str, key: str):
+        """
+        :param path: location of the checkpoint file
+        :param key: identifies the query, for example ResponseCache.key(url, query.to_dict())
+        """
+        self.path = path
+        self.key = key
+        self.__lock = threading.Lock()
+        self.__pages = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                lines = f.read().splitlines()
+            if len(lines) > 0 and decoder.loads(lines[0]).get('key') == key:
+                for line in lines[1:]:
+                    try:
+                        page = decoder.loads(line)
+                    except ValueError:
+                        # the last line may be incomplete when the process was killed while writing it
+                        break
+                    self.__pages[page['offset']] = (page['data'], page['total'])
+                return
+        with open(path, 'w') as f:
+            f.write(json.dumps({'key': key}) + '\n')
+
+    def pop(self, offset: int):
+        """
+        :return: tuple of the items and the total of the page at offset completed by an earlier pull,
+        None when it was not completed yet
+        """
+        with self.__lock:
+            return self.__pages.pop(offset, None)
+
+    def add(self, offset: int, page: (list, int)):
+        """
+        Record a completed page
+        """
+        line = json.dumps({'offset': offset, 'data': page[0], 'total': page[1]}) + '\n'
+        with self.__lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+    def remove(self):
+        """Remove the checkpoint file once the pull has completed"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,6 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from requests import Session
 
 from .auth import Auth
+from .cache import StandardizationCache
 
 
 class Compound:
@@ -16,12 +19,34 @@ class Compound:
         return str(self.__dict__)
 
 
+def standardized(response, url: str) -> (bool, dict):
+    """
+    Read a response of the pa_standardize endpoint
+
+    :param response: requests or httpx response
+    :param url: url of the request, for the error message
+    :return: tuple of whether the service answered and the standardized compound as returned by the service,
+    None when the input could not be standardized
+    """
+    if response.status_code != 200:
+        print(f"Cannot retrieve compounds from {url}: {response.status_code}")
+        print(response.text)
+        return False, None
+    body = response.json()
+    if 'Empty response' in body:
+        return True, None
+    if 'result' in body:
+        return True, body['result'][0]
+    return False, None
+
+
 class ChemistryService:
     """Provides access to the ToxHub Chemistry Service"""
 
-    def __init__(self, base: str, auth: Auth, client: Session):
+    def __init__(self, base: str, auth: Auth, client: Session, cache: StandardizationCache = None):
         self.__auth = auth
         self.url = base + "/chemistryservice.kh.svc/v1"
+        self.cache = cache
         self.__client = client
 
     def compound_by_name(self, name):
@@ -42,6 +67,22 @@ class ChemistryService:
             return compound.smiles
         return None
 
+    def standardize_many(self, names_or_smiles: [str], pa_type: str, workers: int = 8) -> [Compound]:
+        """
+        Standardize many names or smiles, every unique input is sent once and requests run concurrently
+
+        :param names_or_smiles: names when pa_type is 'clinical', smiles when pa_type is 'preclinical'
+        :param pa_type: 'clinical' or 'preclinical'
+        :param workers: maximum number of concurrent requests
+        :return: list with the standardized compound or None of each input, in the same order as names_or_smiles
+        """
+        unique = list(dict.fromkeys(names_or_smiles))
+        if len(unique) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(unique)))) as executor:
+            compounds = dict(zip(unique, executor.map(lambda c: self.__standardize(c, pa_type), unique)))
+        return [compounds[c] for c in names_or_smiles]
+
     def __standardize(self, compound, pa_type):
         """
         Single endpoint provided by Chemistry Service to standardise molecules and retrieve structures from names.
@@ -52,16 +93,13 @@ class ChemistryService:
         :param pa_type: 'clinical' or 'preclincical'
         :return: Standardized compound object or None
         """
+        if self.cache is not None:
+            cached, c = self.cache.get(compound, pa_type)
+            if cached:
+                return Compound(c) if c else None
         url = f'{self.url}/pa_standardize'
         r = self.__client.post(url, data={'compound': compound, 'pa_type': pa_type}, headers=self.__auth.header())
-        if r.status_code == 200:
-            response = r.json()
-            if 'Empty response' in response:
-                return None
-            if 'result' in response:
-                c = response['result'][0]
-                return Compound(c)
-        else:
-            print(f"Cannot retrieve compounds from {url}: {r.status_code}")
-            print(r.text)
-            return None
+        answered, c = standardized(r, url)
+        if answered and self.cache is not None:
+            self.cache.put(compound, pa_type, c)
+        return Compound(c) if c else None
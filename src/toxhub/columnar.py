@@ -0,0 +1,93 @@
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+ORGAN_FIELDS = ['id', 'name', 'code', 'vocabulary']
+
+
+class Columns:
+    """
+    Builds column arrays from pages of query results, without keeping the rows themselves.
+
+    Nested organs are either kept as a single list column (organs='list'),
+    or flattened into organId, organName, organCode and organVocabulary columns with one row per organ
+    (organs='flatten'). Rows without organs are kept once, with empty organ columns.
+    """
+
+    def __init__(self, names: [str], organs: str = 'list'):
+        """
+        :param names: names of the fields that become columns, for example DataClass.FINDING.fields()
+        :param organs: 'list' or 'flatten'
+        """
+        if organs not in ['list', 'flatten']:
+            raise ValueError(f"organs should be 'list' or 'flatten', not '{organs}'")
+        self.__flatten = organs == 'flatten' and 'organs' in names
+        self.names = [n for n in names if not (self.__flatten and n == 'organs')]
+        self.columns = {n: [] for n in self.names}
+        if self.__flatten:
+            for n in ORGAN_FIELDS:
+                self.columns[Columns.__organ_column(n)] = []
+
+    def append(self, rows: [dict]):
+        """
+        Add a page of rows to the columns
+        """
+        if self.__flatten:
+            organs = [row.get('organs') or [None] for row in rows]
+            repeats = [len(o) for o in organs]
+            for n in self.names:
+                self.columns[n].extend(v for row, r in zip(rows, repeats) for v in [row.get(n)] * r)
+            for n in ORGAN_FIELDS:
+                self.columns[Columns.__organ_column(n)].extend(
+                    o.get(n) if o else None for row_organs in organs for o in row_organs)
+        else:
+            for n in self.names:
+                self.columns[n].extend(row.get(n) for row in rows)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def to_dict(self) -> dict:
+        """
+        :return: dict of column name to list of values
+        """
+        return self.columns
+
+    def to_arrow(self):
+        """
+        :return: a pyarrow Table, requires pyarrow
+        """
+        if pyarrow is None:
+            raise ImportError('Arrow output requires pyarrow, install it with: pip install pyarrow')
+        return pyarrow.table(self.columns)
+
+    def to_pandas(self):
+        """
+        :return: a pandas DataFrame, requires pandas
+        """
+        if pandas is None:
+            raise ImportError('Pandas output requires pandas, install it with: pip install pandas')
+        return pandas.DataFrame(self.columns, columns=list(self.columns.keys()))
+
+    def to(self, output: str):
+        """
+        :param output: 'arrow', 'pandas' or 'dict'
+        :return: the columns in the requested format
+        """
+        if output == 'arrow':
+            return self.to_arrow()
+        elif output == 'pandas':
+            return self.to_pandas()
+        elif output == 'dict':
+            return self.to_dict()
+        raise ValueError(f"output should be 'arrow', 'pandas' or 'dict', not '{output}'")
+
+    @staticmethod
+    def __organ_column(name: str) -> str:
+        return 'organ' + name[0].upper() + name[1:]
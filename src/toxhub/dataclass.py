@@ -1,5 +1,7 @@
 from enum import Enum
 
+from .encoding import Categories
+
 
 class DataClass(Enum):
     COMPOUND = ('COMPOUND',
@@ -18,7 +20,29 @@ class DataClass(Enum):
         return self.value[1]
 
 
-class Compound:
+class Record:
+    """
+    Base of the record classes, attributes are kept in __slots__ instead of a dict per instance,
+    which keeps large lists of converted items compact
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_rows(cls, rows: [dict]) -> []:
+        """
+        Convert a page of items returned by a primitive adaptor in one call
+
+        :param rows: items as returned by PrimitiveAdaptor.execute
+        :return: list of records
+        """
+        return list(map(cls, rows))
+
+    def __str__(self):
+        return str({name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)})
+
+
+class Compound(Record):
+    __slots__ = ('id', 'name', 'identifier', 'inchikey', 'smiles', 'organisation', 'confidentiality')
 
     def __init__(self, c: dict):
         self.id: int = int(c.get('id'))
@@ -29,11 +53,9 @@ class Compound:
         self.organisation: str = c.get('organisation')
         self.confidentiality: str = c.get('confidentiality')
 
-    def __str__(self):
-        return str(self.__dict__)
-
 
-class Organ:
+class Organ(Record):
+    __slots__ = ('id', 'name', 'code', 'vocabulary')
 
     def __init__(self, o: dict):
         self.id: int = o.get('id')
@@ -41,11 +63,9 @@ class Organ:
         self.code: str = o.get('code')
         self.vocabulary: str = o.get('vocabulary')
 
-    def __str__(self):
-        return str(self.__dict__)
-
 
-class Frequency:
+class Frequency(Record):
+    __slots__ = ('at_risk', 'affected')
     affected: int
     at_risk: int
 
@@ -64,11 +84,24 @@ class Frequency:
             elif original.isdigit():
                 self.affected = int(original)
 
-    def __str__(self):
-        return str(self.__dict__)
 
+class Finding(Record):
+    __slots__ = ('id', 'identifier', 'name', 'code', 'vocabulary', 'severity', 'observation', 'frequency', 'dose',
+                 'timePoint', 'timePointUnit', 'treatmentRelated', 'compoundId', 'studyId', 'type', 'sex', 'organs')
+
+    @classmethod
+    def from_rows(cls, rows: [dict], categories: Categories = None) -> []:
+        """
+        Convert a page of findings returned by a primitive adaptor in one call
 
-class Finding:
+        :param rows: findings as returned by PrimitiveAdaptor.execute
+        :param categories: optional Categories that interns or encodes the categorical fields,
+        the rows are updated in place
+        :return: list of findings
+        """
+        if categories:
+            rows = map(categories.encode_finding, rows)
+        return list(map(cls, rows))
 
     def __init__(self, f: dict):
         self.id: int = int(f.get('id'))
@@ -83,17 +116,18 @@ class Finding:
         self.timePoint: str = f.get('timepoint')
         self.timePointUnit: str = f.get('timepointUnit')
         self.treatmentRelated = f.get('treatmentRelated')
-        self.compoundId: int = int(f.get('compoundId'))
-        self.studyId: int = int(f.get('studyId'))
+        # compoundId and studyId are absent when they were not selected in the query
+        self.compoundId: int = int(f['compoundId']) if f.get('compoundId') is not None else None
+        self.studyId: int = int(f['studyId']) if f.get('studyId') is not None else None
         self.type: str = f.get('findingType')
         self.sex: str = f.get('sex')
-        self.organs: [Organ] = list(map(lambda o: Organ(o), f.get('organs'))) if f.get('organs') else []
-
-    def __str__(self):
-        return str(self.__dict__)
+        organs = f.get('organs')
+        self.organs: [Organ] = list(map(Organ, organs)) if organs else []
 
 
-class Study:
+class Study(Record):
+    __slots__ = ('id', 'type', 'species', 'age', 'route', 'duration', 'durationUnit', 'modified', 'created',
+                 'organisation', 'confidentiality')
 
     def __init__(self, s: dict):
         self.id: int = s.get('id')
@@ -107,6 +141,3 @@ class Study:
         self.created = s.get('createdDate')
         self.organisation: str = s.get('organisation')
         self.confidentiality: str = s.get('confidentiality')
-
-    def __str__(self):
-        return str(self.__dict__)
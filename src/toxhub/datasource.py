@@ -11,6 +11,9 @@ class DataSource:
     def __eq__(self, other):
         return other.path == self.path
 
+    def __hash__(self):
+        return hash(self.path)
+
 
 class DataSources:
     """Predefined ToxHub data sources"""
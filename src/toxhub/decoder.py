@@ -0,0 +1,46 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Responses are decoded directly from their bytes, with orjson when it is installed.
+# Another decoder can be plugged in by assigning a function taking bytes to toxhub.decoder.loads
+loads = orjson.loads if orjson else json.loads
+
+
+def iter_rows(fp, page: dict):
+    """
+    Incrementally parse a query result page and yield the items of resultData.data while the page is being read,
+    uses ijson when it is installed, otherwise the whole page is read and decoded with loads first.
+
+    :param fp: file like object with the response body, for example the raw stream of a response
+    :param page: dict in which the total of resultData is stored once it has been read
+    :return: generator of the items in the page
+    """
+    if ijson is None:
+        result_data = loads(fp.read())['resultData']
+        page['total'] = result_data['total']
+        yield from result_data['data']
+        return
+    builder = None
+    for prefix, event, value in ijson.parse(fp, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == 'resultData.data.item' and event in ['end_map', 'end_array']:
+                yield builder.value
+                builder = None
+        elif prefix == 'resultData.data.item':
+            if event in ['start_map', 'start_array']:
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            else:
+                yield value
+        elif prefix == 'resultData.total':
+            page['total'] = value
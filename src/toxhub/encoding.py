@@ -0,0 +1,100 @@
+import sys
+import threading
+
+FINDING_FIELDS = ['severity', 'findingVocabulary', 'findingType', 'sex', 'timepointUnit']
+ORGAN_FIELDS = ['code', 'vocabulary', 'name']
+
+
+class Categories:
+    """
+    Dictionaries of the categorical values of findings, such as severity, sex and organ codes,
+    shared by all findings encoded with it.
+
+    In 'intern' mode equal values share a single string object, in 'codes' mode values are replaced with integer codes
+    so group-bys become integer operations, values() gives the value for each code.
+    Organ fields are kept in their own dictionaries, named 'organ' + the capitalised field e.g. 'organCode'.
+    """
+
+    def __init__(self, mode: str = 'codes'):
+        """
+        :param mode: 'intern' or 'codes'
+        """
+        if mode not in ['intern', 'codes']:
+            raise ValueError(f"mode should be 'intern' or 'codes', not '{mode}'")
+        self.mode = mode
+        self.__lock = threading.Lock()
+        self.__codes = {}
+        self.__values = {}
+
+    def encode(self, field: str, value):
+        """
+        :param field: name of the categorical field
+        :param value: value to encode, None is kept as None
+        :return: the interned value, or the code of the value
+        """
+        if value is None:
+            return None
+        if self.mode == 'intern':
+            return sys.intern(value) if isinstance(value, str) else value
+        codes = self.__codes.get(field)
+        code = codes.get(value) if codes is not None else None
+        if code is None:
+            with self.__lock:
+                codes = self.__codes.setdefault(field, {})
+                values = self.__values.setdefault(field, [])
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(values)
+                    values.append(value)
+        return code
+
+    def decode(self, field: str, code):
+        """
+        :return: the value of a code of field, in intern mode the value itself is returned
+        """
+        if self.mode == 'intern' or code is None:
+            return code
+        return self.__values[field][code]
+
+    def fields(self) -> [str]:
+        """
+        :return: names of the fields that have a dictionary
+        """
+        return list(self.__values.keys())
+
+    def values(self, field: str) -> []:
+        """
+        :return: list of the values of field, the index of a value is its code
+        """
+        return list(self.__values.get(field, []))
+
+    def codes(self, field: str) -> dict:
+        """
+        :return: dict of value to code for field
+        """
+        return dict(self.__codes.get(field, {}))
+
+    def encode_finding(self, row: dict) -> dict:
+        """
+        Encode the categorical fields of a finding as returned by a primitive adaptor, the row is updated in place
+
+        :param row: finding
+        :return: the same row, for use as or in an execute converter
+        """
+        for field in FINDING_FIELDS:
+            if field in row:
+                row[field] = self.encode(field, row[field])
+        organs = row.get('organs')
+        if organs:
+            for organ in organs:
+                for field in ORGAN_FIELDS:
+                    if field in organ:
+                        organ[field] = self.encode(Categories.organ_field(field), organ[field])
+        return row
+
+    @staticmethod
+    def organ_field(field: str) -> str:
+        """
+        :return: name of the dictionary of an organ field, e.g. organCode for code
+        """
+        return 'organ' + field[0].upper() + field[1:]
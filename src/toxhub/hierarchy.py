@@ -0,0 +1,195 @@
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from .semanticservice import SemanticService
+
+
+class Hierarchy:
+    """
+    Versioned local snapshot of the MedDRA hierarchy (SOC, HLGT, HLT, PT, LLT) and the SMQs,
+    with precomputed ancestor and descendant indexes so expansion, roll-ups and SMQ membership are answered in memory.
+    Concepts can be referred to by their conceptId or by their conceptCode.
+    """
+
+    def __init__(self, concepts: dict, parents: dict, smqs: dict, version: str):
+        """
+        :param concepts: dict of conceptId to concept, without children
+        :param parents: dict of conceptId to list of parent conceptIds
+        :param smqs: dict of SMQ conceptId to list of member conceptIds
+        :param version: version of the snapshot
+        """
+        self.concepts = concepts
+        self.version = version
+        self.__parents = {c: list(p) for c, p in parents.items()}
+        self.__smqs = {s: frozenset(m) for s, m in smqs.items()}
+        self.__codes = {c.get('conceptCode'): idx for idx, c in concepts.items() if c.get('conceptCode') is not None}
+        self.__children = {}
+        for child, ps in self.__parents.items():
+            for parent in ps:
+                self.__children.setdefault(parent, []).append(child)
+        self.__ancestors = {}
+        for idx in concepts:
+            self.__closure(idx)
+        self.__descendants = {}
+        for idx, ancestors in self.__ancestors.items():
+            for ancestor in ancestors:
+                self.__descendants.setdefault(ancestor, set()).add(idx)
+        self.__smqs_of = {}
+        for smq, members in self.__smqs.items():
+            for member in members:
+                self.__smqs_of.setdefault(member, []).append(smq)
+
+    @staticmethod
+    def download(semantic_service: SemanticService, version: str = None, workers: int = 4):
+        """
+        Download the hierarchy below every SOC and the members of every SMQ
+
+        :param semantic_service: Semantic service to download from
+        :param version: version of the snapshot, today's date by default
+        :param workers: maximum number of concurrent requests
+        :return: the snapshot
+        """
+        concepts, parents, smqs = {}, {}, {}
+
+        def walk(node: dict, parent_id=None):
+            idx = node['conceptId']
+            concepts[idx] = {k: v for k, v in node.items() if k != 'children'}
+            if parent_id is not None and parent_id not in parents.setdefault(idx, []):
+                parents[idx].append(parent_id)
+            for child in node.get('children') or []:
+                walk(child, idx)
+
+        socs = semantic_service.concepts_by_class('SOC') or []
+        smq_concepts = semantic_service.smqs() or []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            trees = executor.map(lambda soc: semantic_service.expand(soc['conceptId'], child_levels=4), socs)
+            members = executor.map(lambda smq: semantic_service.concepts_by_smq(smq['conceptId']), smq_concepts)
+            for tree in trees:
+                for root in tree or []:
+                    walk(root)
+            for smq, smq_members in zip(smq_concepts, members):
+                collected = []
+                stack = list(smq_members or [])
+                while stack:
+                    member = stack.pop()
+                    collected.append(member['conceptId'])
+                    concepts.setdefault(member['conceptId'], {k: v for k, v in member.items() if k != 'children'})
+                    stack.extend(member.get('children') or [])
+                concepts.setdefault(smq['conceptId'], {k: v for k, v in smq.items() if k != 'children'})
+                smqs[smq['conceptId']] = collected
+        return Hierarchy(concepts, parents, smqs, version if version else date.today().isoformat())
+
+    def save(self, path: str):
+        """
+        Store the snapshot as gzipped json
+        """
+        data = {'version': self.version, 'concepts': list(self.concepts.values()),
+                'parents': [[c, p] for c, p in self.__parents.items()],
+                'smqs': [[s, list(m)] for s, m in self.__smqs.items()]}
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+
+    @staticmethod
+    def load(path: str, version: str = None):
+        """
+        Load a snapshot stored with save
+
+        :param path: location of the snapshot
+        :param version: optional version the snapshot must have
+        :return: the snapshot
+        """
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        if version is not None and data['version'] != version:
+            raise ValueError(f"Snapshot {path} has version {data['version']}, expected {version}")
+        return Hierarchy({c['conceptId']: c for c in data['concepts']}, dict(data['parents']), dict(data['smqs']),
+                         data['version'])
+
+    def concept(self, concept) -> dict:
+        """
+        :param concept: conceptId or conceptCode
+        :return: the concept, None when it is not in the snapshot
+        """
+        return self.concepts.get(self.__id(concept))
+
+    def parents(self, concept) -> [dict]:
+        return [self.concepts[p] for p in self.__parents.get(self.__id(concept), [])]
+
+    def children(self, concept) -> [dict]:
+        return [self.concepts[c] for c in self.__children.get(self.__id(concept), [])]
+
+    def ancestors(self, concept) -> [dict]:
+        return [self.concepts[a] for a in self.__ancestors.get(self.__id(concept), ())]
+
+    def descendants(self, concept) -> [dict]:
+        return [self.concepts[d] for d in self.__descendants.get(self.__id(concept), ())]
+
+    def is_under(self, concept, ancestor) -> bool:
+        """
+        :return: whether concept is below ancestor in the hierarchy, for example whether a PT is under a SOC
+        """
+        return self.__id(ancestor) in self.__ancestors.get(self.__id(concept), ())
+
+    def expand(self, concept, parent_levels: int = None, child_levels: int = None) -> [dict]:
+        """
+        In memory counterpart of SemanticService.expand, the concept with its children nested up to child_levels
+        and its parents nested up to parent_levels
+
+        :return: list with the expanded concept, None when it is not in the snapshot
+        """
+        idx = self.__id(concept)
+        if idx not in self.concepts:
+            return None
+        result = dict(self.concepts[idx])
+        result['children'] = self.__nested(idx, self.__children, child_levels or 0, 'children')
+        result['parents'] = self.__nested(idx, self.__parents, parent_levels or 0, 'parents')
+        return [result]
+
+    def smq_members(self, smq) -> [dict]:
+        """
+        :return: the concepts contained in an SMQ
+        """
+        return [self.concepts[m] for m in self.__smqs.get(self.__id(smq), ())]
+
+    def in_smq(self, concept, smq) -> bool:
+        """
+        :return: whether concept, or one of its ancestors, is contained in smq
+        """
+        members = self.__smqs.get(self.__id(smq), frozenset())
+        idx = self.__id(concept)
+        return idx in members or not members.isdisjoint(self.__ancestors.get(idx, ()))
+
+    def smqs_of(self, concept) -> [dict]:
+        """
+        :return: the SMQs that contain concept
+        """
+        return [self.concepts[s] for s in self.__smqs_of.get(self.__id(concept), [])]
+
+    def __id(self, concept):
+        if concept in self.concepts:
+            return concept
+        return self.__codes.get(concept, concept)
+
+    def __closure(self, idx) -> frozenset:
+        ancestors = self.__ancestors.get(idx)
+        if ancestors is None:
+            # mark as in progress, so a cycle in the data does not recurse forever
+            self.__ancestors[idx] = frozenset()
+            result = set()
+            for parent in self.__parents.get(idx, []):
+                result.add(parent)
+                result.update(self.__closure(parent))
+            ancestors = self.__ancestors[idx] = frozenset(result)
+        return ancestors
+
+    def __nested(self, idx, edges: dict, levels: int, key: str) -> [dict]:
+        if levels <= 0:
+            return []
+        result = []
+        for other in edges.get(idx, []):
+            concept = dict(self.concepts[other])
+            concept[key] = self.__nested(other, edges, levels - 1, key)
+            result.append(concept)
+        return result
@@ -0,0 +1,176 @@
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from .semanticservice import SemanticService
+
+
+class LookupIndex:
+    """
+    Local index of the concepts of vocabularies for type-ahead lookups without a request per keystroke.
+    Concept names are kept in sorted arrays, a term matches when its name starts with the query or when every word of
+    the query is the start of a word of its name. Name matches are returned before word matches.
+
+    The index is built from a bulk download per vocabulary and can be refreshed in a background thread,
+    lookups keep using the previous index until a refresh is complete.
+    Assign it to SemanticService.index to serve SemanticService.lookup for the indexed vocabularies.
+    """
+
+    def __init__(self, semantic_service: SemanticService, vocabularies: [str], refresh_interval: float = 24 * 60 * 60,
+                 workers: int = 4):
+        """
+        :param semantic_service: Semantic service to download the concepts from
+        :param vocabularies: vocabularies to index, e.g. ['HPATH', 'MA']
+        :param refresh_interval: Seconds between background refreshes, see start()
+        :param workers: maximum number of concurrent downloads
+        """
+        self.vocabularies = list(vocabularies)
+        self.refresh_interval = refresh_interval
+        self.workers = workers
+        self.__service = semantic_service
+        self.__indexes = {}
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def build(self):
+        """
+        Download the concepts of all vocabularies and replace the index, a vocabulary that fails to download
+        keeps its previous index
+
+        :return: the index itself
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(self.vocabularies)))) as executor:
+            downloads = list(executor.map(self.__service.concepts_by_vocabulary, self.vocabularies))
+        indexes = dict(self.__indexes)
+        for vocabulary, concepts in zip(self.vocabularies, downloads):
+            if concepts is None:
+                print(f'Could not download the concepts of {vocabulary}, the lookup index is not updated')
+            else:
+                indexes[vocabulary] = LookupIndex.__index(concepts)
+        # a single assignment, so lookups see either the old or the new indexes
+        self.__indexes = indexes
+        return self
+
+    def start(self):
+        """
+        Build the index when it is empty and refresh it every refresh_interval seconds in a daemon thread
+
+        :return: the index itself
+        """
+        if len(self.__indexes) == 0:
+            self.build()
+        if self.__thread is None:
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__refresh, name='toxhub-lookup-index', daemon=True)
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background refresh"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def covers(self, vocabularies: [str]) -> bool:
+        """
+        :return: whether all vocabularies are indexed
+        """
+        indexes = self.__indexes
+        return len(vocabularies) > 0 and all(v in indexes for v in vocabularies)
+
+    def lookup(self, term: str, vocabularies: [str], n_results: int = 20) -> [str]:
+        """
+        Local counterpart of SemanticService.lookup, returns terms in the same form as /concept/lookup
+
+        :param term: start of a concept name, or the start of words of a concept name
+        :param vocabularies: indexed vocabularies to search
+        :param n_results: maximum number of terms
+        :return: list of the unique names of the matching concepts, name matches first
+        """
+        limit = n_results
+        while True:
+            # vocabularies can share a name, ask for more until there are enough names
+            found = self.__matches(term, vocabularies, limit)
+            terms = list(dict.fromkeys(concepts[0].get('conceptName') for concepts in found))
+            if len(terms) >= n_results or len(found) < limit:
+                return terms[:n_results]
+            limit += n_results
+
+    def concepts(self, term: str, vocabularies: [str], n_results: int = 20) -> []:
+        """
+        Find concepts the way lookup finds terms
+
+        :param term: start of a concept name, or the start of words of a concept name
+        :param vocabularies: indexed vocabularies to search
+        :param n_results: maximum number of concepts
+        :return: list of matching concepts as downloaded, name matches first
+        """
+        return [c for concepts in self.__matches(term, vocabularies, n_results) for c in concepts][:n_results]
+
+    def __matches(self, term: str, vocabularies: [str], n_results: int) -> [[]]:
+        """
+        :return: up to n_results lists of the concepts sharing a name in one vocabulary, name matches first
+        """
+        indexes = self.__indexes
+        query = term.casefold().strip()
+        words = query.split()
+        if len(words) == 0 or n_results <= 0:
+            return []
+        matches = []
+        for vocabulary in vocabularies:
+            names, name_terms, tokens, token_terms, token_sets = indexes[vocabulary]
+            start = bisect_left(names, query)
+            for i in range(start, min(len(names), start + n_results)):
+                if not names[i].startswith(query):
+                    break
+                matches.append((names[i], name_terms[i]))
+        matches.sort(key=lambda m: m[0])
+        result = [m[1] for m in matches[:n_results]]
+        if len(result) >= n_results:
+            return result
+        seen = {id(t) for t in result}
+        # scan the longest word, it is the most selective, and check the other words against the words of the name
+        longest = max(words, key=len)
+        others = list(words)
+        others.remove(longest)
+        matches = []
+        for vocabulary in vocabularies:
+            names, name_terms, tokens, token_terms, token_sets = indexes[vocabulary]
+            found = 0
+            for i in range(bisect_left(tokens, longest), len(tokens)):
+                if not tokens[i].startswith(longest) or found >= n_results:
+                    break
+                position = token_terms[i]
+                concepts = name_terms[position]
+                if id(concepts) in seen:
+                    continue
+                if all(any(t.startswith(w) for t in token_sets[position]) for w in others):
+                    seen.add(id(concepts))
+                    matches.append((names[position], concepts))
+                    found += 1
+        matches.sort(key=lambda m: m[0])
+        return result + [m[1] for m in matches[:n_results - len(result)]]
+
+    def __refresh(self):
+        while not self.__stop.wait(self.refresh_interval):
+            try:
+                self.build()
+            except Exception as e:
+                # keep the thread alive, the next interval tries again with the previous index in place
+                print(f'Refreshing the lookup index failed: {e!r}')
+
+    @staticmethod
+    def __index(concepts: []) -> tuple:
+        """
+        :return: tuple of the sorted unique names, the concepts of each name, the sorted words, the position in names
+        of each word and the words of each name
+        """
+        by_name = {}
+        for concept in concepts:
+            by_name.setdefault((concept.get('conceptName') or '').casefold(), []).append(concept)
+        names = sorted(by_name)
+        name_terms = [by_name[name] for name in names]
+        token_sets = [frozenset(name.split()) for name in names]
+        words = sorted((token, position) for position, tokens in enumerate(token_sets) for token in tokens)
+        return names, name_terms, [w[0] for w in words], [w[1] for w in words], token_sets
@@ -1,55 +1,260 @@
-import json
+import copy
+from concurrent.futures import ThreadPoolExecutor
 
 from requests import Session
 
+from . import decoder
 from .auth import Auth
+from .cache import ResponseCache
+from .checkpoint import Checkpoint
+from .columnar import Columns
 from .datasource import DataSource
-from .query import Query, DataClass
+from .encoding import Categories
+from .query import Query, DataClass, Filter, ComparisonOperator
+from .retry import RetryPolicy
 
 
 class PrimitiveAdaptor:
 
-    def __init__(self, url: str, auth: Auth, client: Session):
+    def __init__(self, url: str, auth: Auth, client: Session, cache: ResponseCache = None,
+                 retry: RetryPolicy = None):
         self.url = url
+        self.cache = cache
+        self.retry = retry if retry else RetryPolicy()
         self.__auth = auth
         self.__client = client
+        self.__no_batch = set()
+        self.__categories = {}
 
-    def execute(self, query: Query, datasource: DataSource, converter=lambda x: x) -> []:
+    def execute(self, query: Query, datasource: DataSource, converter=lambda x: x, workers: int = 1,
+                checkpoint: str = None) -> []:
         """
-        Execute a query on ToxHub
+        Execute a query on ToxHub. Requests answered with 429 or a 5xx status are retried according to the retry
+        policy, when a page still fails a RuntimeError is raised.
 
         :param query: Query to be executed, can easily be constructed with the QueryBuilder
         :param datasource: Data source at which the query is targeted
         :param converter: optional conversion of returned items, for example 'lambda x: Compound(x)'
+        :param workers: number of pages fetched in parallel once the total is known, 1 fetches pages one at a time
+        :param checkpoint: optional path of a file recording the completed pages, executing the same query again
+        after a failure only fetches the missing pages. The file is removed when all pages have been fetched.
         :return: list of items
         """
         url = f'{self.url}{datasource.path}/query'
-        total = 1
         default_batch_size = 5000
-        query_results = []
         fetch_all = query.limit == 0 or query.limit > default_batch_size
-        # We will copy the original offset and limit and put it back,
-        # so we don't sneakily modify the original query and cause confusion
-        original_offset = int(query.offset)
-        original_limit = int(query.limit)
-        query.limit = default_batch_size if fetch_all else query.limit
-        while total > query.offset:
-            resp = self.__client.post(url, headers=self.__auth.header(), json=query.to_dict())
-            if resp.status_code != 200:
-                print(f'Request to {url} failed {resp.status_code} {resp.text}')
-                return query_results
-            result_data = json.loads(resp.text)['resultData']
-            query_results.extend(result_data['data'])
-            total = result_data['total']
-            query.offset += default_batch_size
-            # If default limit was overridden we will not get everything, but stick to user defined limit
-            if not fetch_all and len(query_results) >= query.limit:
-                break
-        # leaving query in same state as we found it
-        query.offset = original_offset
-        query.limit = original_limit
+        # We work on a copy of the query, so we don't sneakily modify the original query and cause confusion
+        body = query.to_dict()
+        body['limit'] = default_batch_size if fetch_all else query.limit
+        if checkpoint:
+            checkpoint = Checkpoint(checkpoint, ResponseCache.key(url, body))
+        query_results, total = self.__page(url, body, checkpoint)
+        if fetch_all:
+            offsets = range(query.offset + default_batch_size, total, default_batch_size)
+            for page in self.__pages(url, body, offsets, workers, checkpoint):
+                query_results.extend(page[0])
+        if checkpoint:
+            checkpoint.remove()
+        return list(map(converter, query_results))
+
+    def execute_keyset(self, query: Query, datasource: DataSource, converter=lambda x: x, ranges: int = 1) -> []:
+        """
+        Execute a query on ToxHub, paging on the id of the items instead of on an offset.
+        Every page asks for the items with an id greater than the last id of the previous page,
+        so deep pages stay fast and items changing during a long pull do not shift the pages.
+
+        :param query: Query to be executed, sorted on id as built by the QueryBuilder, offset is not supported
+        :param datasource: Data source at which the query is targeted
+        :param converter: optional conversion of returned items, for example 'lambda x: Compound(x)'
+        :param ranges: split the id space in this many ranges that are fetched in parallel
+        :return: list of items
+        """
+        if query.offset != 0:
+            raise ValueError('Keyset pagination does not support an offset')
+        id_field = query.sortFields[0].field
+        url = f'{self.url}{datasource.path}/query'
+        bounds = [(None, None)]
+        if ranges > 1:
+            first = self.__keyset_page(url, query, [], 1)
+            last = self.__keyset_page(url, query, [], 1, 'DESC')
+            if len(first) > 0 and len(last) > 0:
+                low, high = first[0][id_field.name], last[0][id_field.name]
+                step = max(1, -(-(high - low + 1) // ranges))
+                bounds = [(lo - 1, min(lo + step - 1, high)) for lo in range(low, high + 1, step)]
+        with ThreadPoolExecutor(max_workers=len(bounds)) as executor:
+            futures = [executor.submit(self.__keyset_range, url, query, lo, hi) for lo, hi in bounds]
+            query_results = [item for future in futures for item in future.result()]
+        if query.limit > 0:
+            query_results = query_results[:query.limit]
         return list(map(converter, query_results))
 
+    def __keyset_range(self, url: str, query: Query, after, up_to) -> []:
+        """
+        Fetch all items with an id greater than after and up to and including up_to, None means unbounded
+        """
+        default_batch_size = 5000
+        id_field = query.sortFields[0].field
+        batch_size = default_batch_size if query.limit == 0 else min(query.limit, default_batch_size)
+        upper = [] if up_to is None else [id_field.custom_operator([up_to], ComparisonOperator.LESS_THAN_OR_EQUAL)]
+        result = []
+        while True:
+            lower = [] if after is None else [id_field.custom_operator([after], ComparisonOperator.GREATER_THAN)]
+            page = self.__keyset_page(url, query, lower + upper, batch_size)
+            result.extend(page)
+            if len(page) < batch_size or (query.limit > 0 and len(result) >= query.limit):
+                return result
+            after = page[-1][id_field.name]
+
+    def __keyset_page(self, url: str, query: Query, criteria: [], limit: int, order: str = None):
+        keyset_query = copy.copy(query)
+        keyset_query.filter = Filter([and_criteria + criteria for and_criteria in query.filter.criteria])
+        keyset_query.limit = limit
+        body = keyset_query.to_dict()
+        if order:
+            body['sortFields'][0]['order'] = order
+        return self.__page(url, body)[0]
+
+    def execute_many(self, query: Query, datasources: [DataSource], converter=lambda x: x, overrides: dict = None,
+                     merge: bool = False, workers: int = 1):
+        """
+        Execute the same query on several data sources at once, each data source is queried on its own thread
+
+        :param query: Query to be executed on every data source
+        :param datasources: Data sources at which the query is targeted
+        :param converter: optional conversion of returned items, for example 'lambda x: Compound(x)'
+        :param overrides: optional dict of data source to a Query that replaces query for that data source
+        :param merge: return a single list of (data source, item) tuples instead of a dict
+        :param workers: number of pages fetched in parallel per data source
+        :return: dict of data source to list of items, or list of (data source, item) tuples when merge is set
+        """
+        overrides = overrides if overrides else {}
+        if len(datasources) == 0:
+            return [] if merge else {}
+        with ThreadPoolExecutor(max_workers=len(datasources)) as executor:
+            futures = {ds: executor.submit(self.execute, overrides.get(ds, query), ds, converter, workers)
+                       for ds in datasources}
+            results = {ds: future.result() for ds, future in futures.items()}
+        if merge:
+            return [(ds, item) for ds, items in results.items() for item in items]
+        return results
+
+    def iter_execute(self, query: Query, datasource: DataSource, converter=lambda x: x, pages: bool = False,
+                     stream: bool = False):
+        """
+        Execute a query on ToxHub and yield the items as the pages arrive.
+        The next page is fetched in the background while the current page is being processed,
+        so only two pages are held in memory at any time.
+
+        :param query: Query to be executed, can easily be constructed with the QueryBuilder
+        :param datasource: Data source at which the query is targeted
+        :param converter: optional conversion of returned items, for example 'lambda x: Compound(x)'
+        :param pages: yield a list of converted items per page instead of single items
+        :param stream: parse the items of a page while it is being received instead of prefetching the next page,
+        uses ijson when it is installed, responses are not cached in this mode
+        :return: generator of items, or of lists of items when pages is set
+        """
+        url = f'{self.url}{datasource.path}/query'
+        default_batch_size = 5000
+        fetch_all = query.limit == 0 or query.limit > default_batch_size
+        body = query.to_dict()
+        body['limit'] = default_batch_size if fetch_all else query.limit
+        if stream:
+            yield from self.__streamed(url, body, fetch_all, converter, pages)
+            return
+        page = self.__page(url, body)
+        total = page[1]
+        offset = query.offset + default_batch_size
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while page is not None:
+                if fetch_all and offset < total:
+                    next_page = executor.submit(self.__page, url, {**body, 'offset': offset})
+                    offset += default_batch_size
+                else:
+                    next_page = None
+                items = map(converter, page[0])
+                if pages:
+                    yield list(items)
+                else:
+                    yield from items
+                page = next_page.result() if next_page else None
+
+    def execute_columnar(self, query: Query, datasource: DataSource, output: str = 'pandas', organs: str = 'list'):
+        """
+        Execute a query on ToxHub and return the result as columns instead of a list of rows.
+        Columns are built page by page from the selected fields of the first selected data class.
+
+        :param query: Query to be executed, can easily be constructed with the QueryBuilder
+        :param datasource: Data source at which the query is targeted
+        :param output: 'pandas' for a DataFrame, 'arrow' for a pyarrow Table or 'dict' for a dict of lists
+        :param organs: 'list' keeps the organs of a finding in one list column,
+        'flatten' gives one row per organ with organId, organName, organCode and organVocabulary columns
+        :return: the result in the requested format
+        """
+        columns = Columns(query.selectedFields[0].names, organs)
+        for page in self.iter_execute(query, datasource, pages=True):
+            columns.append(page)
+        return columns.to(output)
+
+    def __streamed(self, url: str, body: dict, fetch_all: bool, converter, pages: bool):
+        offset = body['offset']
+        while True:
+            page_body = {**body, 'offset': offset}
+            resp = self.retry.send(
+                lambda: self.__client.post(url, headers=self.__auth.header(), json=page_body, stream=True))
+            if resp.status_code != 200:
+                raise RuntimeError(f'Request to {url} failed {resp.status_code} {resp.text}')
+            resp.raw.decode_content = True
+            page = {}
+            items = map(converter, decoder.iter_rows(resp.raw, page))
+            if pages:
+                items = list(items)
+                count = len(items)
+                yield items
+            else:
+                count = 0
+                for item in items:
+                    count += 1
+                    yield item
+            offset += body['limit']
+            if not fetch_all or count < body['limit'] or offset >= page.get('total', offset + 1):
+                return
+
+    def __pages(self, url: str, body: dict, offsets: range, workers: int, checkpoint: Checkpoint = None):
+        """
+        Fetch the pages at the given offsets and yield them in order
+        """
+        if workers <= 1 or len(offsets) <= 1:
+            for offset in offsets:
+                yield self.__page(url, {**body, 'offset': offset}, checkpoint)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.__page, url, {**body, 'offset': offset}, checkpoint) for offset in offsets]
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def __page(self, url: str, body: dict, checkpoint: Checkpoint = None):
+        """
+        Fetch a single page of query results, from the checkpoint when it was completed before
+
+        :return: tuple of the items in the page and the total number of items
+        """
+        if checkpoint:
+            page = checkpoint.pop(body['offset'])
+            if page:
+                return page
+        resp = self.__send(url, body)
+        if resp.status_code != 200:
+            raise RuntimeError(f'Request to {url} failed {resp.status_code} {resp.text}')
+        result_data = decoder.loads(resp.content)['resultData']
+        page = result_data['data'], result_data['total']
+        if checkpoint:
+            checkpoint.add(body['offset'], page)
+        return page
+
     def compound(self, idx: int, data_source: DataSource):
         return self.__item(idx, data_source, DataClass.COMPOUND)
 
@@ -59,19 +264,69 @@ class PrimitiveAdaptor:
     def finding(self, idx: int, data_source: DataSource):
         return self.__item(idx, data_source, DataClass.FINDING)
 
-    def findings(self, ids: [int], data_source: DataSource) -> []:
-        url = f'{self.url}{data_source.path}/data/FINDING/batch'
-        r = self.__client.post(url, json={'ids': ids}, headers=self.__auth.header())
+    def compounds(self, ids: [int], data_source: DataSource, chunk_size: int = 1000, workers: int = 4) -> []:
+        """
+        Retrieve many compounds at once, see findings
+        """
+        return self.__items(ids, data_source, DataClass.COMPOUND, chunk_size, workers)
+
+    def studies(self, ids: [int], data_source: DataSource, chunk_size: int = 1000, workers: int = 4) -> []:
+        """
+        Retrieve many studies at once, see findings
+        """
+        return self.__items(ids, data_source, DataClass.STUDY, chunk_size, workers)
+
+    def findings(self, ids: [int], data_source: DataSource, chunk_size: int = 1000, workers: int = 4) -> []:
+        """
+        Retrieve many findings at once. The ids are requested in chunks from the batch endpoint of the data source,
+        chunks are sent concurrently. When the data source has no batch endpoint the items are requested one by one,
+        also concurrently. A batch request that still fails after retrying raises a RuntimeError.
+
+        :param ids: ids of the findings
+        :param data_source: Data source containing the findings
+        :param chunk_size: maximum number of ids per batch request
+        :param workers: maximum number of concurrent requests
+        :return: list of findings in the same order as ids, None for ids that do not exist
+        """
+        return self.__items(ids, data_source, DataClass.FINDING, chunk_size, workers)
+
+    def __items(self, ids: [int], data_source: DataSource, data_class: DataClass, chunk_size: int,
+                workers: int) -> []:
+        unique_ids = list(dict.fromkeys(ids))
+        chunks = [unique_ids[i:i + chunk_size] for i in range(0, len(unique_ids), chunk_size)]
+        items = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for chunk, batch in zip(chunks, executor.map(lambda c: self.__batch(c, data_source, data_class), chunks)):
+                if batch is None:
+                    singles = executor.map(lambda idx: self.__item(idx, data_source, data_class), chunk)
+                    batch = [item for item in singles if item]
+                for item in batch:
+                    items[str(item.get('id'))] = item
+        return [items.get(str(idx)) for idx in ids]
+
+    def __batch(self, ids: [int], data_source: DataSource, data_class: DataClass):
+        """
+        Retrieve a chunk of items from the batch endpoint
+
+        :return: list of items, or None when the data source has no batch endpoint for the data class
+        """
+        if (data_source.path, data_class) in self.__no_batch:
+            return None
+        url = f'{self.url}{data_source.path}/data/{data_class.key()}/batch'
+        r = self.retry.send(lambda: self.__client.post(url, json={'ids': ids}, headers=self.__auth.header()))
         if r.status_code == 200:
-            return json.loads(r.text)
+            return decoder.loads(r.content)
+        elif r.status_code in [404, 405, 501]:
+            self.__no_batch.add((data_source.path, data_class))
+            return None
         else:
-            print(f'Failed to load findings from {data_source}')
+            raise RuntimeError(f'Failed to load {data_class.key().lower()}s from {url}: {r.status_code} {r.text}')
 
     def __item(self, idx: int, data_source: DataSource, data_class: DataClass):
         url = f'{self.url}{data_source.path}/data/{data_class.key()}/{idx}'
-        r = self.__client.get(url, headers=self.__auth.header())
+        r = self.__send(url)
         if r.status_code == 200:
-            return json.loads(r.text)
+            return decoder.loads(r.content)
         else:
             print(f'Failed to get {data_class.key().lower()} {idx} from {data_source}')
 
@@ -88,13 +343,45 @@ class PrimitiveAdaptor:
         total = 1
         result = []
         while total > query['offset']:
-            r = self.__client.post(url, headers=self.__auth.header(), json=query)
+            r = self.__send(url, query)
             if r.status_code == 200:
-                response = json.loads(r.text)
+                response = decoder.loads(r.content)
                 result.extend(response['data'])
                 total = response['total']
                 query['offset'] += batch_size
             else:
-                print(f"Cannot retrieve compoundIds from {url}: {r.status_code}")
-                break
+                raise RuntimeError(f'Cannot retrieve {property_name} from {url}: {r.status_code} {r.text}')
         return result
+
+    def categories(self, datasource: DataSource, mode: str = 'codes') -> Categories:
+        """
+        Shared dictionaries of the categorical finding values of a data source, created on first use.
+        Use it in the conversion of findings, for example converter=categories.encode_finding,
+        or Finding.from_rows(rows, categories)
+
+        :param datasource: Data source the dictionaries belong to
+        :param mode: 'codes' or 'intern', only used when the dictionaries are created
+        :return: the Categories of the data source
+        """
+        if datasource.path not in self.__categories:
+            self.__categories.setdefault(datasource.path, Categories(mode))
+        return self.__categories[datasource.path]
+
+    def __send(self, url: str, body: dict = None):
+        """
+        POST body to url, or GET url when there is no body.
+        Successful responses are served from and stored in the cache when one is configured.
+        """
+        if self.cache is None:
+            return self.__request(url, body)
+
+        def load():
+            resp = self.__request(url, body)
+            return resp, resp.content if resp.status_code == 200 else None
+
+        return self.cache.fetch(ResponseCache.key(url, body), load)
+
+    def __request(self, url: str, body: dict = None):
+        if body is None:
+            return self.retry.send(lambda: self.__client.get(url, headers=self.__auth.header()))
+        return self.retry.send(lambda: self.__client.post(url, headers=self.__auth.header(), json=body))
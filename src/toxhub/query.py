@@ -103,9 +103,16 @@ class Fields:
 
 class SelectedField:
 
-    def __init__(self, data_class: DataClass):
+    def __init__(self, data_class: DataClass, fields: [str] = None):
         self.dataClassKey = data_class.key()
-        self.names = data_class.fields()
+        if fields is None:
+            self.names = data_class.fields()
+        else:
+            unknown = [f for f in fields if f not in data_class.fields()]
+            if len(unknown) > 0:
+                raise ValueError(f'Unknown fields for {data_class.key()}: {unknown}')
+            # the id is always selected, it is needed for paging and for linking items
+            self.names = ['id'] + [f for f in dict.fromkeys(fields) if f != 'id']
 
 
 class SortField:
@@ -173,27 +180,32 @@ class QueryBuilder:
 
     def __init__(self):
         self.dataClasses = []
+        self.selectedFields = []
         self.criteriaList = []
 
-    def select(self, data_class: DataClass):
+    def select(self, data_class: DataClass, fields: [str] = None):
         """
         :param data_class: Class you wish to select
+        :param fields: optional subset of data_class.fields() to return, all fields when omitted.
+        The id is always returned.
         :return: QueryBuilder
         """
         self.dataClasses.append(data_class)
+        self.selectedFields.append(SelectedField(data_class, fields))
         return self
 
-    def select_all(self, data_class: DataClass):
+    def select_all(self, data_class: DataClass, fields: [str] = None):
         """
         Select all items available for given DataClass, does not work for findings!
 
         :param data_class:
+        :param fields: optional subset of data_class.fields() to return, all fields when omitted
         :return:
         """
         if data_class == DataClass.FINDING:
             raise Exception("Don't try and select all findings, this is a bad idea, I won't allow it")
         else:
-            return self.select(data_class).where(
+            return self.select(data_class, fields).where(
                 Field(data_class, 'id').custom_operator([-1], ComparisonOperator.NOT_EQUAL))
 
     def where(self, criteria: FieldCriteria):
@@ -209,5 +221,5 @@ class QueryBuilder:
         :return: A query that can be executed in the primitive adaptor
         """
         sort_field = SortField(Field(self.dataClasses[0], 'id'))
-        selected_fields = list(map(lambda dc: SelectedField(dc), self.dataClasses))
-        return Query(sort_fields=[sort_field], filter=Filter([self.criteriaList]), selected_fields=selected_fields)
+        return Query(sort_fields=[sort_field], filter=Filter([self.criteriaList]),
+                     selected_fields=list(self.selectedFields))
@@ -0,0 +1,61 @@
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+
+class RetryPolicy:
+    """
+    Retries requests that were answered with 429 or a 5xx status, or that failed to connect,
+    with exponential backoff and full jitter. A Retry-After header of the response takes precedence.
+    """
+
+    def __init__(self, retries: int = 5, backoff: float = 0.5, max_backoff: float = 60,
+                 statuses: [int] = (429, 500, 502, 503, 504)):
+        """
+        :param retries: maximum number of retries after the first attempt, 0 disables retrying
+        :param backoff: base delay in seconds, doubled for every retry
+        :param max_backoff: maximum delay in seconds between two attempts
+        :param statuses: status codes that are retried
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def send(self, request):
+        """
+        :param request: function without arguments that sends the request and returns the response
+        :return: the first response that should not be retried, or the last response when retries run out
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = request()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                print(f'Request failed: {e}, retrying')
+                time.sleep(self.delay(attempt))
+                continue
+            if response.status_code not in self.statuses or attempt == self.retries:
+                return response
+            print(f'Request to {response.url} returned {response.status_code}, retrying')
+            time.sleep(self.delay(attempt, response))
+
+    def delay(self, attempt: int, response=None) -> float:
+        """
+        :return: seconds to wait before the next attempt
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                try:
+                    wait = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(wait, 0), self.max_backoff)
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
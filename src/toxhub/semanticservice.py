@@ -1,20 +1,26 @@
-import json
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-from requests import Response, Session
+from requests import Session
 
+from . import decoder
 from .auth import Auth
+from .cache import ConceptCache, ResponseCache
 
 
 class SemanticService:
 
-    def __init__(self, url, auth: Auth, client: Session):
+    def __init__(self, url, auth: Auth, client: Session, cache: ConceptCache = None):
         self.url = url + "/api/semanticservice/v1"
+        self.cache = cache
+        self.index = None
         self.__auth = auth
         self.__client = client
 
     def lookup(self, term: str, vocabularies: [str], n_results: int = 20) -> [str]:
-        v = self.__vocabulary_param_string(vocabularies)
+        if self.index is not None and self.index.covers(vocabularies):
+            return self.index.lookup(term, vocabularies, n_results)
+        v = vocabulary_param_string(vocabularies)
         params = {'query': term, 'count': n_results}
         path = "/concept/lookup?" + urllib.parse.urlencode(params) + v
         resp = self.__get(path)
@@ -26,12 +32,25 @@ class SemanticService:
             return []
         if vocabularies is None:
             vocabularies = []
-        v = self.__vocabulary_param_string(vocabularies)
+        v = vocabulary_param_string(vocabularies)
         params = {'term': term, 'nonpreferred': nonpreferred}
         path = '/concept/normalize?' + urllib.parse.urlencode(params) + v
         resp = self.__get(path)
         return resp.get('concepts')
 
+    def normalize_many(self, terms: [str], vocabularies: [str] = None, nonpreferred: bool = False,
+                       workers: int = 8) -> [[]]:
+        """
+        Normalize many terms, every unique term is requested once and requests run concurrently
+
+        :param terms: terms to normalize
+        :param vocabularies: see normalize
+        :param nonpreferred: see normalize
+        :param workers: maximum number of concurrent requests
+        :return: list with the concepts of each term, in the same order as terms
+        """
+        return self.__many(lambda term: self.normalize(term, vocabularies, nonpreferred), terms, workers)
+
     def concept_by_id(self, concept_id: int):
         resp = self.__get(f'/concept/{concept_id}')
         if resp:
@@ -43,11 +62,30 @@ class SemanticService:
 
         :return: list of SMQs
         """
-        params = {"conceptClassId": "SMQ"}
+        return self.concepts_by_class('SMQ')
+
+    def concepts_by_class(self, concept_class_id: str) -> []:
+        """
+        Retrieve all concepts of a concept class, for example 'SMQ' or 'SOC'
+
+        :param concept_class_id: concept class
+        :return: list of concepts
+        """
+        params = {"conceptClassId": concept_class_id}
         resp = self.__get(f'/concept', params=params)
         if resp:
             return resp
 
+    def concepts_by_vocabulary(self, vocabulary_id: str) -> []:
+        """
+        Retrieve all concepts of a vocabulary, for example 'HPATH' or 'MA'.
+        The response is not cached, as it is used to build and refresh a LookupIndex
+
+        :param vocabulary_id: vocabulary
+        :return: list of concepts
+        """
+        return self.__load('/concept', {'vocabularyId': vocabulary_id})[0]
+
     def concepts_by_smq(self, concept_id: int) -> []:
         """
         Retrieve all the preferred terms for an SMQ
@@ -82,28 +120,94 @@ class SemanticService:
         if result:
             return result['mappings']
 
-    def socs_for_findings(self, findings: [dict]):
+    def map_to_clinical_many(self, codes: [(str, str)], workers: int = 8) -> [[]]:
+        """
+        Map many preclinical adverse event and organ code combinations, see map_to_clinical.
+        Every unique combination is requested once and requests run concurrently
+
+        :param codes: list of (adverse event code, organ code) tuples
+        :param workers: maximum number of concurrent requests
+        :return: list with the mappings of each combination, in the same order as codes
+        """
+        return self.__many(lambda c: self.map_to_clinical(c[0], c[1]), [tuple(c) for c in codes], workers)
+
+    def map_to_preclinical_many(self, adverse_event_codes: [str], workers: int = 8) -> [[]]:
+        """
+        Map many MedDRA Preferred Terms, see map_to_preclinical.
+        Every unique code is requested once and requests run concurrently
+
+        :param adverse_event_codes: codes to map
+        :param workers: maximum number of concurrent requests
+        :return: list with the mappings of each code, in the same order as adverse_event_codes
+        """
+        return self.__many(self.map_to_preclinical, adverse_event_codes, workers)
+
+    @staticmethod
+    def __many(function, inputs: [], workers: int) -> []:
+        """
+        Apply function once to every unique input on a thread pool
+        :return: list with the result for each input, in the same order as inputs
+        """
+        unique = list(dict.fromkeys(inputs))
+        if len(unique) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(unique)))) as executor:
+            results = dict(zip(unique, executor.map(function, unique)))
+        return [results[i] for i in inputs]
+
+    def socs_for_findings(self, findings: [dict], chunk_size: int = 100, workers: int = 4):
         """
-        Retrieve the system organ class for a concept code or a MA or PT concept name
+        Retrieve the system organ class for a concept code or a MA or PT concept name.
+        The unique codes of all findings are requested in chunks, chunks are sent concurrently.
 
         :param findings:
-        :return: list of mappings
+        :param chunk_size: number of codes per request
+        :param workers: maximum number of concurrent requests
+        :return: list of mappings, one per unique code
+        """
+        if not isinstance(findings, list):
+            findings = [findings]
+        return [soc for socs in self.__socs(finding_codes(findings), chunk_size, workers) for soc in socs]
+
+    def socs_by_finding(self, findings: [dict], chunk_size: int = 100, workers: int = 4) -> [[]]:
+        """
+        Retrieve the system organ classes of each finding, every unique code is requested once
+
+        :param findings:
+        :param chunk_size: number of codes per request
+        :param workers: maximum number of concurrent requests
+        :return: list with the mappings of the codes of each finding, in the same order as findings.
+        Mappings are matched to the findings on their conceptCode, the code that was mapped, a RuntimeError is raised
+        when a mapping has none.
         """
         if not isinstance(findings, list):
             findings = [findings]
+        codes = finding_codes(findings)
+        by_code = {}
+        for socs in self.__socs(codes, chunk_size, workers):
+            for entry in socs:
+                # every entry is the concept of a requested code, its SOCs are listed under 'mapping'
+                code = entry.get('conceptCode')
+                if code is None:
+                    raise RuntimeError(f'SOC mapping without the concept code it maps: {entry}')
+                by_code.setdefault(str(code), []).append(entry)
+        return [[soc for code in finding_keys(f) for soc in by_code.get(str(code), [])] for f in findings]
+
+    def __socs(self, codes: [], chunk_size: int, workers: int) -> [[]]:
+        chunks = self.__chunks(codes, chunk_size)
+        if len(chunks) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as executor:
+            return [socs if socs else [] for socs in executor.map(self.socs_by_concept_codes, chunks)]
 
-        result = []
-        for i in range(0, len(findings), 100):
-            codes = self.__keys(findings[i:i + 100])
-            if len(codes) > 0:
-                socs = self.socs_by_concept_codes(codes)
-                result.extend(socs)
-        return result
+    @staticmethod
+    def __chunks(codes: [], chunk_size: int) -> [[]]:
+        return [codes[i:i + chunk_size] for i in range(0, len(codes), chunk_size)]
 
     def socs_by_concept_codes(self, codes: []):
         url = f'{self.url}/concept/map/soc'
         r = self.__client.post(url, headers=self.__auth.header(), json={'conceptCodes': codes})
-        return self.__validated(r, url)
+        return validated(r, url)
 
     def concept_by_name(self, concept_name: str, vocabularies: [str] = None) -> []:
         if vocabularies is None:
@@ -125,46 +229,64 @@ class SemanticService:
             return resp['concepts']
 
     def __get(self, path: str, params: dict = None):
+        if self.cache is None:
+            return self.__load(path, params)[0]
+        return self.cache.fetch(ResponseCache.key(self.url + path, params), lambda: self.__load(path, params))
+
+    def __load(self, path: str, params: dict = None):
+        """
+        :return: tuple of the validated response and its content, the content is None when the request failed
+        """
         url = self.url + path
         if params:
             resp = self.__client.get(url, headers=self.__auth.header(), params=params)
         else:
             resp = self.__client.get(url, headers=self.__auth.header())
-        return self.__validated(resp, url)
+        result = validated(resp, url)
+        return result, resp.content if 200 <= resp.status_code <= 299 else None
 
-    @staticmethod
-    def __validated(response: Response, url: str):
-        if 200 <= response.status_code <= 299:
-            return json.loads(response.text)
-        elif response.status_code == 404:
-            print(f'Request returned 404 {response.text}')
-            return None
-        elif 400 <= response.status_code <= 499:
-            print(f'Something went wrong requesting data from {url} {response.status_code} {response.text}')
-        elif 500 <= response.status_code <= 599:
-            raise RuntimeError(f'Request to {url} failed: {response.status_code} {response.text}')
 
-    @staticmethod
-    def __keys(findings: []):
-        if not isinstance(findings, list):
-            findings = [findings]
+def validated(response, url: str):
+    """
+    :param response: requests or httpx response of the semantic service
+    :return: the decoded body of a successful response, None when the request failed with a 4xx status
+    """
+    if 200 <= response.status_code <= 299:
+        return decoder.loads(response.content)
+    elif response.status_code == 404:
+        print(f'Request returned 404 {response.text}')
+        return None
+    elif 400 <= response.status_code <= 499:
+        print(f'Something went wrong requesting data from {url} {response.status_code} {response.text}')
+    elif 500 <= response.status_code <= 599:
+        raise RuntimeError(f'Request to {url} failed: {response.status_code} {response.text}')
 
-        result = []
-        for finding in findings:
-            # clinical
-            if finding.get('findingVocabulary') == 'MedDRA' and finding.get('findingCode') not in result:
-                result.append(finding['findingCode'])
-            # preclinical
-            elif finding.get('organs') and len(finding.get('organs')) > 0:
-                organs = finding.get('organs')
-                for o in organs:
-                    if o['vocabulary'] == 'MA' and o['code'] not in result:
-                        result.append(o['code'])
-        return result
 
-    @staticmethod
-    def __vocabulary_param_string(vocabularies: [str]):
-        string = ''
-        for vocabulary in vocabularies:
-            string += '&vocabularies=' + vocabulary
-        return string
+def finding_codes(findings: []) -> []:
+    """
+    :return: the unique codes of the findings, in order of appearance
+    """
+    result = {}
+    for finding in findings:
+        for code in finding_keys(finding):
+            result[code] = None
+    return list(result)
+
+
+def finding_keys(finding: dict) -> []:
+    """
+    :return: the codes of a finding that are mapped to SOCs, the MedDRA code of a clinical finding or the MA organ
+    codes of a preclinical finding
+    """
+    # clinical
+    if finding.get('findingVocabulary') == 'MedDRA':
+        return [finding['findingCode']]
+    # preclinical
+    return [o['code'] for o in finding.get('organs') or [] if o['vocabulary'] == 'MA']
+
+
+def vocabulary_param_string(vocabularies: [str]) -> str:
+    string = ''
+    for vocabulary in vocabularies:
+        string += '&vocabularies=' + vocabulary
+    return string
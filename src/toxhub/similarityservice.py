@@ -1,8 +1,11 @@
-import json
+import concurrent.futures
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from requests import Session
 
+from . import decoder
 from .auth import Auth
 from .datasource import DataSource
 
@@ -19,12 +22,79 @@ class SimilarStructure:
         return str(self.__dict__)
 
 
+def similar_structures(obj) -> [SimilarStructure]:
+    """
+    :param obj: decoded results of a finished similarity search
+    :return: the similar structures of the search
+    """
+    result = []
+    if obj:
+        if ('search_results' in obj) and (len(obj['search_results']) == 1):
+            search_result = obj['search_results'][0]
+            if 'obj_nam' in search_result:
+                for i in range(len(search_result['obj_nam'])):
+                    result.append(SimilarStructure(
+                        name=search_result['obj_nam'][i],
+                        smiles=search_result['SMILES'][i],
+                        idx=int(search_result['obj_id'][i]),
+                        distance=float('{:.4f}'.format(search_result['distances'][i]))))
+    return result
+
+
+class SimilarityMatrix:
+    """
+    Results of SimilarityService.search_many, results[i][j] is the list of structures similar to smiles[i]
+    in spaces[j]
+    """
+
+    def __init__(self, smiles: [str], spaces: [(DataSource, str)], results: [[[SimilarStructure]]]):
+        self.smiles = smiles
+        self.spaces = spaces
+        self.results = results
+
+    def ranking(self, query: int, n_res: int = None) -> [(SimilarStructure, DataSource, str)]:
+        """
+        Merged ranking of the structures similar to one query across all spaces, by increasing distance.
+        A structure found in several spaces is ranked once, at its smallest distance.
+
+        :param query: index of the query smiles
+        :param n_res: optional maximum number of structures
+        :return: list of tuples of the similar structure and the data source and algo of the space it was found in
+        """
+        best = {}
+        for (datasource, algo), structures in zip(self.spaces, self.results[query]):
+            for structure in structures:
+                found = best.get(structure.smiles)
+                if found is None or structure.distance < found[0].distance:
+                    best[structure.smiles] = (structure, datasource, algo)
+        ranking = sorted(best.values(), key=lambda r: r[0].distance)
+        return ranking[:n_res] if n_res is not None else ranking
+
+    def rankings(self, n_res: int = None) -> [[(SimilarStructure, DataSource, str)]]:
+        """
+        :return: the merged ranking of every query, in the same order as smiles
+        """
+        return [self.ranking(i, n_res) for i in range(len(self.smiles))]
+
+
 class SimilarityService:
 
-    def __init__(self, toxhub_url, auth: Auth, client: Session):
+    def __init__(self, toxhub_url, auth: Auth, client: Session, poll_interval: float = 0.05,
+                 max_poll_interval: float = 2, poll_workers: int = 8):
+        """
+        :param poll_interval: Seconds before the first poll of the results of a search
+        :param max_poll_interval: Maximum number of seconds between polls of a running search
+        :param poll_workers: Maximum number of searches polled concurrently by the background poller
+        """
         self.__auth = auth
         self.url = toxhub_url + '/flame.kh.svc/api/v1'
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_workers = poll_workers
         self.__client = client
+        self.__condition = threading.Condition()
+        self.__pending = []
+        self.__poller = None
 
     def ready(self) -> bool:
         """
@@ -47,45 +117,146 @@ class SimilarityService:
         :param cutoff: threshold ranging from 0 - 1
         :return: a list of similar structures
         """
+        return self.submit(smiles, datasource, algo, n_res, cutoff).result()
+
+    def submit(self, smiles: str, datasource: DataSource, algo: str = 'morganFP', n_res: int = 10,
+               cutoff=0.5) -> Future:
+        """
+        Start a search for similar compounds without waiting for its results.
+        The results of all outstanding searches are collected by one background poller, which polls a search
+        after poll_interval seconds and backs off to max_poll_interval seconds while the search is running.
+
+        :param smiles: smiles to find similiar structures for
+        :param datasource: datasource in which to search
+        :param algo: e.g. substructureFP, rdkFP, RDKit_md, morganFP
+        :param n_res: number of results
+        :param cutoff: threshold ranging from 0 - 1
+        :return: a future of the list of similar structures, use result(timeout) to wait for it
+        """
+        future = Future()
         space = f'{datasource.chemicalSpace}_{algo}'
         url = f'{self.url}/search/space/{space}/version/0/smiles?numsel={n_res}&cutoff={cutoff}'
         r = self.__client.put(url=url, headers=self.__auth.header(), data={'SMILES': smiles})
+        if r.status_code != 200:
+            print('request failed:' + str(r.status_code) + ', msg:' + r.text)
+            future.set_result([])
+            return future
+        search_id = r.text.replace('"', '')
+        with self.__condition:
+            # future, search id, time of the next poll, current interval
+            self.__pending.append([future, search_id, time.monotonic() + self.poll_interval, self.poll_interval])
+            if self.__poller is None or not self.__poller.is_alive():
+                self.__poller = threading.Thread(target=self.__poll, name='toxhub-similarity-poller', daemon=True)
+                self.__poller.start()
+            self.__condition.notify()
+        return future
 
-        result = []
+    def search_many(self, smiles: [str], spaces: [(DataSource, str)], n_res: int = 10, cutoff=0.5, workers: int = 8,
+                    timeout: float = None) -> SimilarityMatrix:
+        """
+        Search structures similar to many smiles in many spaces at once. Every unique combination of smiles and space
+        is submitted once, submissions run concurrently and the background poller polls the searches concurrently.
 
-        # get the results from the backend
-        if r.status_code == 200:
-            search_id = r.text.replace('"', '')
-            retry = True
-            while retry:
-                # Give it one second before trying
-                time.sleep(1)
-                r2 = self.__client.get(self.url + '/smanage/search/' + search_id, headers=self.__auth.header())
-                if r2.status_code == 200:
-                    if 'waiting' not in r2.text:
-                        obj = json.loads(r2.text)
-                        if obj:
-                            if ('search_results' in obj) and (len(obj['search_results']) == 1):
-                                search_result = obj['search_results'][0]
-                                if 'obj_nam' in search_result:
-                                    for i in range(len(search_result['obj_nam'])):
-                                        result.append(SimilarStructure(
-                                            name=search_result['obj_nam'][i],
-                                            smiles=search_result['SMILES'][i],
-                                            idx=int(search_result['obj_id'][i]),
-                                            distance=float('{:.4f}'.format(search_result['distances'][i]))))
-                        retry = False
-                else:
-                    print('Collecting results failed:' + str(r2.status_code) + ', msg:' + r2.text)
-                    retry = False
-        else:
-            print('request failed:' + str(r.status_code) + ', msg:' + r.text)
-        return result
+        :param smiles: smiles to find similiar structures for
+        :param spaces: list of (datasource, algo) tuples, e.g. [(DataSources.MEDLINE, 'morganFP')]
+        :param n_res: number of results per search
+        :param cutoff: threshold ranging from 0 - 1
+        :param workers: maximum number of concurrent submissions
+        :param timeout: optional maximum number of seconds to wait for all results
+        :return: matrix with the similar structures of each smiles in each space, a failed search has no structures
+        """
+        spaces = [tuple(space) for space in spaces]
+        datasources = {datasource.chemicalSpace: datasource for datasource, _ in spaces}
+        searches = list(dict.fromkeys((s, datasource.chemicalSpace, algo)
+                                      for s in smiles for datasource, algo in spaces))
+        submitted = {}
+        if len(searches) > 0:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(searches)))) as executor:
+                futures = executor.map(lambda q: self.submit(q[0], datasources[q[1]], q[2], n_res, cutoff), searches)
+                submitted = dict(zip(searches, futures))
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        results = {}
+        for search, future in submitted.items():
+            try:
+                results[search] = future.result(None if deadline is None else max(0, deadline - time.monotonic()))
+            except concurrent.futures.TimeoutError:
+                for outstanding in submitted.values():
+                    outstanding.cancel()
+                raise
+            except Exception as e:
+                print(f'Similarity search of {search[0]} in {search[1]}_{search[2]} failed: {e}')
+                results[search] = []
+        return SimilarityMatrix(list(smiles), spaces, [[results[(s, datasource.chemicalSpace, algo)]
+                                                         for datasource, algo in spaces] for s in smiles])
+
+    def __poll(self):
+        with ThreadPoolExecutor(max_workers=max(1, self.poll_workers)) as executor:
+            while True:
+                with self.__condition:
+                    while len(self.__pending) == 0:
+                        self.__condition.wait()
+                    now = time.monotonic()
+                    due = [search for search in self.__pending if search[2] <= now]
+                    if len(due) == 0:
+                        self.__condition.wait(min(search[2] for search in self.__pending) - now)
+                        continue
+                finished = [search for search, done in zip(due, executor.map(self.__poll_guarded, due)) if done]
+                with self.__condition:
+                    for search in finished:
+                        self.__pending.remove(search)
+
+    def __poll_guarded(self, search: list) -> bool:
+        try:
+            return self.__poll_search(search)
+        except Exception as e:
+            # a single search must not stop the poller, which serves all outstanding searches
+            print(f'Polling similarity search {search[1]} failed: {e}')
+            SimilarityService.__resolve(search[0], exception=e)
+            return True
+
+    def __poll_search(self, search: list) -> bool:
+        """
+        Poll the results of a search once
+
+        :return: whether the search is finished
+        """
+        future, search_id = search[0], search[1]
+        if future.done():
+            return True
+        try:
+            r = self.__client.get(self.url + '/smanage/search/' + search_id, headers=self.__auth.header())
+            if r.status_code != 200:
+                print('Collecting results failed:' + str(r.status_code) + ', msg:' + r.text)
+                SimilarityService.__resolve(future, [])
+            elif 'waiting' in r.text:
+                search[3] = min(search[3] * 1.5, self.max_poll_interval)
+                search[2] = time.monotonic() + search[3]
+                return False
+            else:
+                SimilarityService.__resolve(future, similar_structures(decoder.loads(r.content)))
+        except Exception as e:
+            SimilarityService.__resolve(future, exception=e)
+        return True
+
+    @staticmethod
+    def __resolve(future: Future, result=None, exception: Exception = None):
+        """
+        Set the result or exception of a future, unless the caller cancelled it in the meantime
+        """
+        if future.done():
+            return
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except concurrent.futures.InvalidStateError:
+            pass
 
     def spaces(self):
         r = self.__client.get(self.url + '/smanage/spaces', headers=self.__auth.header())
         if r.status_code == 200:
-            obj = json.loads(r.text)
+            obj = decoder.loads(r.content)
             return obj[1]
 
     def space_names(self):
@@ -0,0 +1,110 @@
+from .datasource import DataSource
+from .primitiveadaptor import PrimitiveAdaptor
+
+
+class ResultStore:
+    """
+    In-memory store of fetched findings, studies and compounds of one data source, indexed by id and by the
+    compoundId, studyId, organ code and finding code of the findings, for hash joins without requests per row.
+    Items can be the dicts returned by a primitive adaptor or the records of the dataclass module, ids are indexed
+    as integers whatever type they arrive in.
+    """
+
+    def __init__(self):
+        self.compounds = {}
+        self.studies = {}
+        self.findings = {}
+        self.__by_compound = {}
+        self.__by_study = {}
+        self.__by_organ = {}
+        self.__by_code = {}
+
+    def add_compounds(self, compounds: []):
+        for c in compounds:
+            if c is not None:
+                self.compounds[ResultStore.__id_of(c, 'id')] = c
+
+    def add_studies(self, studies: []):
+        for s in studies:
+            if s is not None:
+                self.studies[ResultStore.__id_of(s, 'id')] = s
+
+    def add_findings(self, findings: []):
+        for f in findings:
+            if f is None:
+                continue
+            idx = ResultStore.__id_of(f, 'id')
+            if idx in self.findings:
+                continue
+            self.findings[idx] = f
+            self.__by_compound.setdefault(ResultStore.__id_of(f, 'compoundId'), []).append(f)
+            self.__by_study.setdefault(ResultStore.__id_of(f, 'studyId'), []).append(f)
+            self.__by_code.setdefault(ResultStore.__value(f, 'findingCode', 'code'), []).append(f)
+            for organ in ResultStore.__value(f, 'organs', 'organs') or []:
+                self.__by_organ.setdefault(ResultStore.__value(organ, 'code', 'code'), []).append(f)
+
+    def findings_by_compound(self, compound_id: int) -> []:
+        return list(self.__by_compound.get(ResultStore.__id(compound_id), []))
+
+    def findings_by_study(self, study_id: int) -> []:
+        return list(self.__by_study.get(ResultStore.__id(study_id), []))
+
+    def findings_by_organ(self, organ_code: str) -> []:
+        return list(self.__by_organ.get(organ_code, []))
+
+    def findings_by_code(self, finding_code: str) -> []:
+        return list(self.__by_code.get(finding_code, []))
+
+    def missing(self) -> ([int], [int]):
+        """
+        :return: ids of the compounds and of the studies referenced by the findings that are not in the store
+        """
+        compound_ids = [idx for idx in self.__by_compound if idx is not None and idx not in self.compounds]
+        study_ids = [idx for idx in self.__by_study if idx is not None and idx not in self.studies]
+        return compound_ids, study_ids
+
+    def fetch_missing(self, primitive_adaptor: PrimitiveAdaptor, datasource: DataSource, converters: dict = None):
+        """
+        Retrieve the compounds and studies referenced by the findings that are not in the store yet,
+        with the bulk retrieval of the primitive adaptor
+
+        :param primitive_adaptor: Primitive adaptor used to retrieve the items
+        :param datasource: Data source the findings were retrieved from
+        :param converters: optional dict with a 'compound' and/or 'study' conversion, for example {'study': Study}
+        """
+        converters = converters if converters else {}
+        compound_ids, study_ids = self.missing()
+        if len(compound_ids) > 0:
+            convert = converters.get('compound', lambda x: x)
+            self.add_compounds(convert(c) for c in primitive_adaptor.compounds(compound_ids, datasource) if c)
+        if len(study_ids) > 0:
+            convert = converters.get('study', lambda x: x)
+            self.add_studies(convert(s) for s in primitive_adaptor.studies(study_ids, datasource) if s)
+
+    def findings_with_study_and_compound(self, findings: [] = None) -> []:
+        """
+        Join findings with their study and compound
+
+        :param findings: findings to join, all findings in the store when omitted
+        :return: list of (finding, study, compound) tuples, study or compound is None when it is not in the store
+        """
+        findings = self.findings.values() if findings is None else findings
+        return [(f, self.studies.get(ResultStore.__id_of(f, 'studyId')),
+                 self.compounds.get(ResultStore.__id_of(f, 'compoundId'))) for f in findings]
+
+    @staticmethod
+    def __id(value):
+        """
+        Ids are compared as integers, records convert them while dicts keep the type sent by the data source
+        """
+        return int(value) if value is not None else None
+
+    @staticmethod
+    def __id_of(item, key: str):
+        return ResultStore.__id(ResultStore.__value(item, key, key))
+
+    @staticmethod
+    def __value(item, key: str, attribute: str):
+        if isinstance(item, dict):
+            return item.get(key)
+        return getattr(item, attribute, None)
@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import threading
+
+from .datasource import DataSource
+from .primitiveadaptor import PrimitiveAdaptor
+from .query import QueryBuilder, DataClass, Fields, ComparisonOperator
+
+
+class LocalStore:
+    """Local copy of ToxHub records in a SQLite database, with a high-water mark per data source and data class"""
+
+    def __init__(self, path: str = 'toxhub_store.sqlite'):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock, self.__db:
+            self.__db.execute('CREATE TABLE IF NOT EXISTS records (source TEXT, data_class TEXT, id INTEGER, '
+                              'data TEXT, PRIMARY KEY (source, data_class, id))')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS watermarks (source TEXT, data_class TEXT, value TEXT, '
+                              'PRIMARY KEY (source, data_class))')
+
+    def upsert(self, datasource: DataSource, data_class: DataClass, items: [dict]):
+        """
+        Insert the items, or replace them when an item with the same id is already stored
+        """
+        rows = [(datasource.path, data_class.key(), item['id'], json.dumps(item)) for item in items]
+        with self.__lock, self.__db:
+            self.__db.executemany('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)', rows)
+
+    def items(self, datasource: DataSource, data_class: DataClass) -> [dict]:
+        """
+        :return: all stored items of data_class for the data source
+        """
+        with self.__lock:
+            rows = self.__db.execute('SELECT data FROM records WHERE source = ? AND data_class = ? ORDER BY id',
+                                     (datasource.path, data_class.key())).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def watermark(self, datasource: DataSource, data_class: DataClass):
+        """
+        :return: the highest modification date synced for the data source, None when it was never synced
+        """
+        with self.__lock:
+            row = self.__db.execute('SELECT value FROM watermarks WHERE source = ? AND data_class = ?',
+                                    (datasource.path, data_class.key())).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, datasource: DataSource, data_class: DataClass, value: str):
+        with self.__lock, self.__db:
+            self.__db.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)',
+                              (datasource.path, data_class.key(), value))
+
+
+class IncrementalSync:
+    """
+    Keeps a LocalStore up to date with a data source by only fetching the studies modified since the last sync,
+    together with the findings of those studies. Records deleted in the data source are not removed locally.
+    """
+
+    def __init__(self, primitive_adaptor: PrimitiveAdaptor, store: LocalStore, chunk_size: int = 1000):
+        self.__pa = primitive_adaptor
+        self.store = store
+        self.chunk_size = chunk_size
+
+    def sync(self, datasource: DataSource, workers: int = 1) -> dict:
+        """
+        Fetch the studies modified since the high-water mark of the data source and the findings of those studies,
+        upsert them in the store and move the high-water mark to the latest modification date seen.
+        The first sync of a data source fetches all studies.
+
+        :param datasource: Data source to synchronise
+        :param workers: number of pages fetched in parallel
+        :return: number of studies and findings that were upserted
+        """
+        watermark = self.store.watermark(datasource, DataClass.STUDY)
+        if watermark is None:
+            study_query = QueryBuilder().select_all(DataClass.STUDY).build()
+        else:
+            # records modified at exactly the high-water mark may have been added after the last sync,
+            # so those are fetched again, upserting them twice is harmless
+            study_query = QueryBuilder().select(DataClass.STUDY).where(
+                Fields.STUDY_MODIFIED.custom_operator([watermark], ComparisonOperator.GREATER_THAN_OR_EQUAL)).build()
+        studies = self.__pa.execute(study_query, datasource, workers=workers)
+
+        finding_count = 0
+        study_ids = [s['id'] for s in studies]
+        for i in range(0, len(study_ids), self.chunk_size):
+            finding_query = QueryBuilder().select(DataClass.FINDING).where(
+                Fields.FINDING_STUDY_ID.in_(study_ids[i:i + self.chunk_size])).build()
+            findings = self.__pa.execute(finding_query, datasource, workers=workers)
+            self.store.upsert(datasource, DataClass.FINDING, findings)
+            finding_count += len(findings)
+
+        # studies are stored last, so an interrupted sync fetches the findings of these studies again
+        self.store.upsert(datasource, DataClass.STUDY, studies)
+        modified = [s['modifiedDate'] for s in studies if s.get('modifiedDate')]
+        if len(modified) > 0 and (watermark is None or max(modified) > watermark):
+            self.store.set_watermark(datasource, DataClass.STUDY, max(modified))
+        return {'studies': len(studies), 'findings': finding_count}
@@ -1,15 +1,19 @@
 import requests
 
 from .auth import Auth
+from .cache import ConceptCache, ResponseCache, StandardizationCache
 from .chemistryservice import ChemistryService
 from .primitiveadaptor import PrimitiveAdaptor
+from .retry import RetryPolicy
 from .semanticservice import SemanticService
 from .similarityservice import SimilarityService
 
 
 class ToxHub:
 
-    def __init__(self, username: str, password: str, env: str, client_secret: str, session_verify=True):
+    def __init__(self, username: str, password: str, env: str, client_secret: str, session_verify=True,
+                 cache: ResponseCache = None, retry: RetryPolicy = None, concept_cache: ConceptCache = None,
+                 standardization_cache: StandardizationCache = None):
         """
         Base class of the ToxHub library
 
@@ -20,6 +24,11 @@ class ToxHub:
         :param session_verify: Override when using self-signed certificates.
         Set to false if you want to ignore certificate checks,
         alternatively pass path to .pem file to allow self-signed certificate.
+        :param cache: Optional persistent cache for responses of the primitive adaptors
+        :param retry: Optional policy for retrying failed requests of the primitive adaptors,
+        by default failed requests are retried 5 times
+        :param concept_cache: Optional cache for the lookups of the semantic service
+        :param standardization_cache: Optional persistent cache for the standardizations of the chemistry service
         """
         print('Initializing ToxHub')
         url = f'https://{env}.toxhub.etransafe.eu'
@@ -27,8 +36,8 @@ class ToxHub:
         session.verify = session_verify
         auth = Auth(username, password, env, client_secret, session)
         self.auth = auth
-        self.semanticService = SemanticService(url, auth, session)
-        self.chemistryService = ChemistryService(url, auth, session)
+        self.semanticService = SemanticService(url, auth, session, concept_cache)
+        self.chemistryService = ChemistryService(url, auth, session, standardization_cache)
         self.similarityService = SimilarityService(url, auth, session)
-        self.primitiveAdaptor = PrimitiveAdaptor(url, auth, session)
+        self.primitiveAdaptor = PrimitiveAdaptor(url, auth, session, cache, retry)
         print('Initialized ToxHub')
@@ -0,0 +1,31 @@
+import asyncio
+
+from src.toxhub.asynctoxhub import AsyncToxHub
+from src.toxhub.datasource import DataSources
+from src.toxhub.query import QueryBuilder, Fields, DataClass
+from tests.credentials import Credentials
+
+
+async def main():
+    cred = Credentials()
+    async with AsyncToxHub(cred.username, cred.password, cred.env, cred.client_secret) as toxhub:
+        omeprazole = await toxhub.chemistryService.compound_by_name('omeprazole')
+        print(omeprazole)
+
+        sources = [DataSources.MEDLINE, DataSources.FAERS, DataSources.CLINCAL_TRIALS, DataSources.DAILYMED]
+        query = QueryBuilder().select(DataClass.FINDING).where(
+            Fields.COMPOUND_INCHIKEY.eq_(omeprazole.inchikey)).build()
+        results = await asyncio.gather(*[toxhub.primitiveAdaptor.execute(query, source) for source in sources])
+        for source, findings in zip(sources, results):
+            print(f'{len(findings)} findings in {source}')
+
+        socs = await asyncio.gather(*[toxhub.semanticService.socs_for_findings(f) for f in results])
+        print(f'{sum(map(len, socs))} SOC mappings')
+
+        similar = await toxhub.similarityService.get(omeprazole.smiles, DataSources.MEDLINE)
+        for compound in similar:
+            print(compound)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from src.toxhub.cache import ResponseCache
+
+
+def stored(path: str) -> (int, int):
+    with sqlite3.connect(path) as db:
+        return db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+
+
+def test_eviction():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cache.sqlite')
+        cache = ResponseCache(path, max_size=5000)
+        for i in range(200):
+            # an entry that is read on every put is the most recently used one and is never evicted
+            cache.get('k0')
+            cache.put(f'k{i}', os.urandom(100))
+            # the entry that was just stored is never evicted by its own put
+            assert cache.get(f'k{i}') is not None
+            count, size = stored(path)
+            assert 0 < size <= 5000
+        # eviction stops at 90% of max_size instead of emptying the cache
+        assert count > 30
+        assert cache.get('k0') is not None
+        assert cache.get('k1') is None
+        assert cache.get('k199') is not None
+
+
+def test_shared_database():
+    interval = ResponseCache.RECOUNT_INTERVAL
+    ResponseCache.RECOUNT_INTERVAL = 10
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.sqlite')
+            caches = [ResponseCache(path, max_size=5000), ResponseCache(path, max_size=5000)]
+            for i in range(400):
+                caches[i % 2].put(f'k{i}', os.urandom(100))
+            # each cache only misses the puts of the other one since its last recount
+            assert stored(path)[1] <= 5000 + 10 * 120
+    finally:
+        ResponseCache.RECOUNT_INTERVAL = interval
+
+
+def test_ttl():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResponseCache(os.path.join(directory, 'cache.sqlite'), ttl=0.2)
+        cache.put('key', b'value')
+        assert cache.get('key') == b'value'
+        time.sleep(0.3)
+        assert cache.get('key') is None
+        assert stored(os.path.join(directory, 'cache.sqlite'))[0] == 0
+
+
+def main():
+    test_eviction()
+    test_shared_database()
+    test_ttl()
+    print('ResponseCache eviction and ttl ok')
+
+
+if __name__ == "__main__":
+    main()
@@ -20,9 +20,8 @@ def main():
 
     pa = toxhub.primitiveAdaptor
     sources = [DataSources.MEDLINE, DataSources.FAERS, DataSources.CLINCAL_TRIALS, DataSources.ETOX]
-    for source in sources:
-        query = QueryBuilder().select(DataClass.STUDY).where(Fields.COMPOUND_SMILES.eq_(omeprazole.smiles)).build()
-        studies = pa.execute(query, source)
+    query = QueryBuilder().select(DataClass.STUDY).where(Fields.COMPOUND_SMILES.eq_(omeprazole.smiles)).build()
+    for source, studies in pa.execute_many(query, sources).items():
         print(f'{len(studies)} studies in {source}')
 
     query = QueryBuilder().select(DataClass.FINDING).where(Fields.COMPOUND_SMILES.eq_(omeprazole.smiles)).build()
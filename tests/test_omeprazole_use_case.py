@@ -34,7 +34,7 @@ def main():
         print(compound)
 
     # Standardize compounds to get inchikeys which will be used to search databases
-    standardized_compounds = list(map(lambda c: chem_serv.compound_by_name(c.name), sim_compounds))
+    standardized_compounds = chem_serv.standardize_many([c.name for c in sim_compounds], 'clinical')
     for compound in standardized_compounds:
         print(f'{compound.name} {compound.inchikey}')
 